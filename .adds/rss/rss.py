@@ -33,631 +33,3919 @@ OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 
 Features:
-- Fetches RSS feeds from config file
-- Generates random identicon covers
-- Resizes images to 30% of original size
-- Creates EPUB with proper Chinese language support
+- Fetches RSS feeds from config file concurrently (bounded per host)
+- Loads heavy modules on first use, so fetching starts right after launch
+- Revalidates feeds with ETag / Last-Modified and reuses unchanged ones without parsing them
+- Optionally fetches the full article for feeds that only carry summaries (cached, concurrent)
+- Shares one keep-alive HTTP session for feeds and images
+- Optional background daemon that prefetches feeds and images while Wi-Fi is up,
+  so the menu action only assembles the EPUB
+- Finishes within a run deadline, adapts timeouts per host and skips hosts that keep failing
+- Generates random identicon covers (or one cached cover per day / set of articles)
+- Downloads images concurrently and fits them to the Kobo screen in a worker pool
+- Caches processed images on disk and stores identical images only once
+- Streams images with size caps, drops tracking pixels early and keeps only the first frame of animations
+- Optional grayscale / 16-level dithered image encoding for e-ink panels
+- Only includes articles not delivered by an earlier day's run (--full for all)
+- Drops copies of the same article in overlapping feeds (by GUID, link and text simhash)
+- Streams chapters and images into the EPUB as they are ready (flat memory use)
+- Lays out chapters of similar size (short articles merged, long ones split) with minified markup
+- Optionally splits the output into per-feed or size-bounded volumes written in parallel
+- Optionally renders several output profiles (directory, image settings, language)
+  from one fetch, downloading each image once
+- Writes a JSON run summary (stage timers, counters, per-feed records) next to the EPUB
+- Creates EPUB with proper Chinese language support (--language for other languages)
 - Optimized for Kobo e-reader devices
 - DRM-free output
 
 Usage:
-    python rss.py
+    python rss.py [--config PATH] [--output-dir DIR] [--cache-dir DIR]
+                  [--language zh-CN] [--render-profiles PATH]
+                  [--image-resize screen|scale] [--max-image-size 1264x1680]
+                  [--image-encoding color|grayscale|eink] [--full] [--keep-duplicates]
+                  [--cover-seed random|date|content] [--split none|feed|size]
+                  [--volume-size 20M] [--volume-chapters N] [--chapter-size 64K]
+                  [--zip-policy auto|deflate|store]
+                  [--zip-level 1-9] [--deadline 300]
+                  [--no-store] [--profile cpu|memory|all]
+    python rss.py --daemon [--interval 3600]
 
 Requirements:
     - feedparser
     - requests
     - beautifulsoup4
-    - ebooklib
     - Pillow
+    - lxml (optional, faster HTML parsing)
 """
 
-import feedparser
-import requests
-from bs4 import BeautifulSoup
-from ebooklib import epub
 import os
 import datetime
 import pathlib
-from urllib.parse import urlparse
+from urllib.parse import urlparse, urljoin, parse_qsl, urlencode
 import random
-from PIL import Image, ImageDraw 
 import uuid 
 import stat
+import sys
+import importlib
+import importlib.util
+import time
+import threading
+import json
+import pickle
+import hashlib
+import io
+import argparse
+import calendar
+import contextlib
+import sqlite3
+import re
+import zipfile
+import zlib
+from html import escape, unescape
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
+# feedparser, requests, bs4 and PIL are imported on first use through
+# lazy_import(), so the script reads its config and starts fetching
+# feeds without waiting for every heavy module to load
 
-def read_config():
-    """Read RSS links from config file in the same directory"""
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+CONFIG_PATH = os.path.join(SCRIPT_DIR, "config")
+CACHE_DIR = os.path.join(SCRIPT_DIR, "cache")
+OUTPUT_DIR = "/mnt/onboard/RSS"
+LANGUAGE = "zh-CN"             # Language tag of the EPUB and its pages
+RENDER_PROFILES_PATH = None    # Output profiles rendered from one fetch (see read_profiles), None for one EPUB
+
+# Kobo screen resolution (Libra Colour), used for the cover and image bounds
+SCREEN_WIDTH = 1264
+SCREEN_HEIGHT = 1680
+
+
+# Shared HTTP client
+HTTP_POOL_CONNECTIONS = 32     # Number of hosts kept in the connection pool
+HTTP_POOL_MAXSIZE = 4          # Keep-alive connections kept per host
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+_http_session = None
+_http_session_lock = threading.Lock()
+_http_stats = {'requests': 0, 'connections_opened': 0}
+_http_stats_lock = threading.Lock()
+
+# Run deadline, adaptive timeouts and per-host circuit breaker
+RUN_DEADLINE = 300             # Seconds for the whole run, 0 for no limit
+FETCH_DEADLINE_SHARE = 0.5     # Share of the deadline by which feeds must be fetched
+IMAGE_DEADLINE_SHARE = 0.8     # Share by which images must be ready, the rest is for writing the EPUB
+FEED_TIMEOUT = 30              # Longest timeout of a feed request in seconds
+IMAGE_TIMEOUT = 10             # Longest timeout of an image request in seconds
+MIN_TIMEOUT = 3                # Shortest adaptive timeout
+CONNECT_TIMEOUT = 5            # Longest time to establish a connection
+HOST_FAILURE_THRESHOLD = 3     # Consecutive runs in which a host failed before it is skipped
+HOST_COOLDOWN = 3600           # First skip period in seconds, doubled on each further failed run
+HOST_COOLDOWN_MAX = 24 * 3600
+HOST_HEALTH_EXPIRE_DAYS = 30   # Hosts not contacted for this long are forgotten
+HOST_HEALTH_PATH = os.path.join(CACHE_DIR, "hosts.json")
+
+_run_started = time.monotonic()
+_host_health = None
+_host_health_lock = threading.Lock()
+_host_run_results = {}         # Host to [successes, failures] of this run, applied by save_host_health()
+
+# Concurrent feed fetching
+MAX_FETCH_WORKERS = 6          # Total feeds fetched at the same time
+MAX_CONNECTIONS_PER_HOST = 2   # Concurrent requests allowed against a single host
+
+# Image pipeline
+MAX_IMAGE_DOWNLOADS = 8        # Images downloaded at the same time
+IMAGE_PROCESS_WORKERS = max(1, min(4, os.cpu_count() or 1))  # Threads decoding and resizing images
+IMAGE_RESIZE_MODE = "screen"   # "screen": fit inside IMAGE_MAX_SIZE, "scale": legacy 30% of original
+IMAGE_MAX_SIZE = (SCREEN_WIDTH, SCREEN_HEIGHT)
+IMAGE_ENCODING = "color"       # "color", "grayscale" (8-bit gray) or "eink" (16-level dithered gray)
+EINK_GRAY_LEVELS = 16
+IMAGE_MAX_BYTES = 8 * 1024 * 1024        # Downloads growing past this are abandoned
+IMAGE_RUN_MAX_BYTES = 100 * 1024 * 1024  # Image bytes downloaded per run, later images are left out
+IMAGE_PROBE_BYTES = 16 * 1024  # Bytes read before checking format and dimensions
+IMAGE_MIN_SIDE = 2             # Narrower or shorter images (tracking pixels) are dropped
+IMAGE_MAX_PIXELS = 30000000    # Larger images are dropped, except JPEGs which decode scaled down
+# EPUB core image formats that can be stored without re-encoding
+KEEP_AS_IS_FORMATS = {
+    'JPEG': ('jpg', 'image/jpeg'),
+    'PNG': ('png', 'image/png'),
+    'GIF': ('gif', 'image/gif'),
+}
+
+# Per-feed options, set after the URL in config (see parse_config_line)
+DEFAULT_FEED_OPTIONS = {
+    'max_entries': 10,         # Newest entries taken from the feed
+    'max_images': None,        # Images kept per article, None for all
+    'max_bytes': None,         # Budget for article text and images of the feed, None for no limit
+    'max_age': None,           # Entries older than this many seconds are skipped
+    'text_only': False,        # Drop images and embedded media
+    'full_text': False,        # Fetch the linked page for entries that only carry a summary
+}
+FEED_OPTIONS = {}              # Options read from config, by feed URL
+
+# Conditional GET cache (ETag / Last-Modified) for feeds
+FEED_CACHE_PATH = os.path.join(CACHE_DIR, "feeds.sqlite3")
+FEED_CACHE_MAX_ENTRIES = 64    # Least recently used feeds beyond this are evicted
+
+_feed_cache_db = None
+_feed_cache_lock = threading.Lock()
+
+# Full-article extraction for feeds with the full_text option
+FULL_TEXT_SUMMARY_CHARS = 400  # Entries with less text than this are treated as summaries
+FULL_TEXT_WORKERS = 4          # Article pages fetched at the same time
+FULL_TEXT_TIMEOUT = 10         # Seconds an article page may take, download included
+FULL_TEXT_MAX_BYTES = 1024 * 1024  # Larger pages are not read
+FULL_TEXT_DEADLINE_SHARE = 0.65  # Share of the deadline by which article pages must be fetched
+FULL_TEXT_FRESH = 24 * 3600    # Extracts younger than this are used without asking the server
+FULL_TEXT_CACHE_MAX_ENTRIES = 1000  # Least recently used extracts beyond this are evicted
+
+# Index of articles already delivered in an EPUB
+SEEN_INDEX_PATH = os.path.join(CACHE_DIR, "seen.sqlite3")
+SEEN_EXPIRE_DAYS = 30          # Records older than this are forgotten
+FULL_REBUILD = False           # Include articles delivered by earlier runs
+
+# Cross-feed de-duplication
+DEDUPLICATE = True             # Drop articles already present in an earlier feed
+DUPLICATE_MAX_DISTANCE = 3     # Simhash bits in which two copies of an article may differ
+SIMHASH_MIN_TOKENS = 50        # Shorter texts are only compared by link and GUID
+SIMHASH_MAX_TOKENS = 4000      # Only the start of long articles is fingerprinted
+TRACKING_PARAMS = re.compile(r'^(utm_\w+|fbclid|gclid|mc_cid|mc_eid|spm|ref)$')
+
+# Content-addressed cache of processed images
+IMAGE_CACHE_DIR = os.path.join(CACHE_DIR, "images")
+IMAGE_CACHE_MAX_BYTES = 64 * 1024 * 1024  # Least recently used images beyond this are evicted
+DROPPED_IMAGE_EXPIRE_DAYS = 30 # Tracking pixels and oversized images are not requested again for this long
+
+_image_cache_index = None
+_image_cache_lock = threading.Lock()
+_image_cache_in_use = set()    # Blobs the current run puts in its EPUBs, never evicted by it
+
+# Identicon covers generated from a seed
+COVER_SEED = "random"          # "random", "date" (one cover per day) or "content" (one per set of articles)
+COVER_CACHE_DIR = os.path.join(CACHE_DIR, "covers")
+COVER_CACHE_MAX_ENTRIES = 8
+
+# Background prefetch (--daemon) and the warm article store it fills
+DAEMON_INTERVAL = 3600         # Seconds between refreshes
+NETWORK_POLL_INTERVAL = 60     # Seconds between checks for Wi-Fi while it is off
+WARM_STORE_MAX_AGE = 6 * 3600  # Older stores are ignored and feeds fetched again
+USE_WARM_STORE = True          # Build from the warm store when it is fresh
+WARM_STORE_PATH = os.path.join(CACHE_DIR, "store.pickle")
+WARM_STORE_VERSION = 2         # Stores of another version are ignored
+DAEMON_STATUS_PATH = os.path.join(CACHE_DIR, "daemon.txt")
+DAEMON_PID_PATH = os.path.join(CACHE_DIR, "daemon.pid")
+CACHE_LOCK_PATH = os.path.join(CACHE_DIR, ".lock")
+
+# Splitting the output into several EPUBs
+SPLIT_MODE = "none"            # "none", "feed" (one EPUB per feed) or "size" (by byte/chapter budget)
+VOLUME_MAX_BYTES = 20 * 1024 * 1024  # Estimated size budget per volume, 0 for none
+VOLUME_MAX_CHAPTERS = 0        # Articles per volume, 0 for no limit
+VOLUME_WORKERS = max(1, min(2, os.cpu_count() or 1))  # Processes writing volumes
+
+# Chapter layout
+CHAPTER_TARGET_BYTES = 64 * 1024  # Small articles are merged and long ones split into XHTML files of about this size, 0 for one file per article
+
+# EPUB container compression
+ZIP_POLICY = "auto"            # "auto" (store compressed media, deflate the rest), "deflate" (everything) or "store" (nothing)
+ZIP_LEVEL = 6                  # Deflate level for XHTML, CSS and other text, 1 (fast) to 9 (small)
+# Media types that are already compressed, deflating them costs time and saves next to nothing
+COMPRESSED_MEDIA_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp'}
+
+# Heavy modules loaded in the background while the first feeds download
+PRELOAD_MODULES = ('feedparser', 'bs4', 'PIL.Image', 'PIL.ImageDraw')
+
+
+def lazy_import(name):
+    """
+    Import a module on first use and record how long loading it took
+    
+    Safe to call from several threads, the import system makes late
+    callers wait until the module is fully initialized.
+    """
+    if name in sys.modules:
+        return importlib.import_module(name)
+    start = time.perf_counter()
+    module = importlib.import_module(name)
+    metrics.imported(name, time.perf_counter() - start)
+    return module
+
+
+def preload_modules(names=PRELOAD_MODULES):
+    """Import modules needed by later stages on a background thread"""
+    def preload():
+        for name in names:
+            try:
+                lazy_import(name)
+            except ImportError as e:
+                # Reported again by the stage that needs the module
+                print(f"Could not preload {name}: {e}")
+    
+    thread = threading.Thread(target=preload, name='preload', daemon=True)
+    thread.start()
+    return thread
+
+
+def _count_http(counter):
+    with _http_stats_lock:
+        _http_stats[counter] += 1
+
+
+def _counting_adapter_class():
+    """
+    Build an HTTP adapter class whose pools count new connections and requests
+    
+    The classes derive from requests and urllib3, so they are created
+    when the shared session is, not at import time.
+    """
+    HTTPAdapter = lazy_import('requests.adapters').HTTPAdapter
+    connectionpool = lazy_import('urllib3.connectionpool')
+    
+    class CountingHTTPConnectionPool(connectionpool.HTTPConnectionPool):
+        def _new_conn(self):
+            _count_http('connections_opened')
+            return super()._new_conn()
+        
+        def _make_request(self, *args, **kwargs):
+            _count_http('requests')
+            return super()._make_request(*args, **kwargs)
+    
+    class CountingHTTPSConnectionPool(connectionpool.HTTPSConnectionPool):
+        def _new_conn(self):
+            _count_http('connections_opened')
+            return super()._new_conn()
+        
+        def _make_request(self, *args, **kwargs):
+            _count_http('requests')
+            return super()._make_request(*args, **kwargs)
+    
+    class CountingHTTPAdapter(HTTPAdapter):
+        def init_poolmanager(self, *args, **kwargs):
+            super().init_poolmanager(*args, **kwargs)
+            self.poolmanager.pool_classes_by_scheme = {
+                'http': CountingHTTPConnectionPool,
+                'https': CountingHTTPSConnectionPool,
+            }
+    
+    return CountingHTTPAdapter
+
+
+def _accept_encoding():
+    """Content encodings the installed urllib3 can decode"""
+    encodings = ['gzip', 'deflate']
+    try:
+        import brotli  # noqa: F401
+        encodings.append('br')
+    except ImportError:
+        try:
+            import brotlicffi  # noqa: F401
+            encodings.append('br')
+        except ImportError:
+            pass
+    return ', '.join(encodings)
+
+
+def get_http_session(pool_maxsize=None):
+    """
+    Return the shared keep-alive HTTP session used for feeds and images
+    
+    Args:
+        pool_maxsize: Keep-alive connections per host, only used when the
+            session is first created (defaults to HTTP_POOL_MAXSIZE)
+            
+    Returns:
+        requests.Session shared by all downloads
+    """
+    global _http_session
+    with _http_session_lock:
+        if _http_session is None:
+            session = lazy_import('requests').Session()
+            adapter = _counting_adapter_class()(
+                pool_connections=HTTP_POOL_CONNECTIONS,
+                pool_maxsize=pool_maxsize or HTTP_POOL_MAXSIZE,
+            )
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            session.headers.update({
+                'User-Agent': USER_AGENT,
+                'Accept-Encoding': _accept_encoding(),
+            })
+            _http_session = session
+        return _http_session
+
+
+def http_stats():
+    """Return request and connection counters of the shared HTTP session"""
+    with _http_stats_lock:
+        stats = dict(_http_stats)
+    stats['connections_reused'] = max(0, stats['requests'] - stats['connections_opened'])
+    return stats
+
+
+class HostUnavailable(Exception):
+    """Raised instead of sending a request to a skipped host or after the deadline"""
+
+
+def start_deadline():
+    """Start counting RUN_DEADLINE from now"""
+    global _run_started
+    _run_started = time.monotonic()
+
+
+def time_left(share=1.0):
+    """Seconds until the given share of RUN_DEADLINE has passed, None without a deadline"""
+    if not RUN_DEADLINE:
+        return None
+    return _run_started + RUN_DEADLINE * share - time.monotonic()
+
+
+def load_host_health():
+    """Load latency and failure history per host, once per run"""
+    global _host_health
+    with _host_health_lock:
+        if _host_health is None:
+            try:
+                with open(HOST_HEALTH_PATH, 'r') as f:
+                    _host_health = json.load(f)
+            except (OSError, ValueError):
+                _host_health = {}
+        return _host_health
+
+
+def save_host_health():
+    """
+    Count this run in the host history and write it back to disk
+    
+    A host failed the run when none of its requests succeeded. Hosts not
+    seen for a long time are forgotten.
+    """
+    if _host_health is None:
+        return
+    oldest = time.time() - HOST_HEALTH_EXPIRE_DAYS * 86400
+    with _host_health_lock:
+        for host, (successes, failures) in _host_run_results.items():
+            record = _host_health.setdefault(host, {'failures': 0})
+            if successes:
+                record['failures'] = 0
+                record.pop('skip_until', None)
+                continue
+            record['failures'] = record.get('failures', 0) + 1
+            if record['failures'] >= HOST_FAILURE_THRESHOLD and record.get('skip_until', 0) <= time.time():
+                cooldown = min(HOST_COOLDOWN * 2 ** (record['failures'] - HOST_FAILURE_THRESHOLD), HOST_COOLDOWN_MAX)
+                record['skip_until'] = int(time.time() + cooldown)
+                print(f"Host {host} failed {record['failures']} runs in a row, skipping it for {cooldown // 60} minutes")
+                metrics.count('hosts_skipped')
+        _host_run_results.clear()
+        for host in [host for host, record in _host_health.items() if record.get('last_seen', 0) < oldest]:
+            del _host_health[host]
+        try:
+            os.makedirs(os.path.dirname(HOST_HEALTH_PATH), exist_ok=True)
+            with open(HOST_HEALTH_PATH + ".tmp", 'w') as f:
+                json.dump(_host_health, f, indent=1, sort_keys=True)
+            os.replace(HOST_HEALTH_PATH + ".tmp", HOST_HEALTH_PATH)
+        except OSError as e:
+            print(f"Could not save host history: {e}")
+
+
+def host_timeout(host, limit):
+    """
+    Timeout for a request to a host, adapted to its history
+    
+    Hosts that answered before get a generous multiple of their usual
+    response time, hosts that failed recently get a shorter timeout with
+    every failure. The result is never above limit or below MIN_TIMEOUT.
+    """
+    record = load_host_health().get(host, {})
+    timeout = limit
+    if record.get('latency'):
+        timeout = min(timeout, record['latency'] * 4 + 1)
+    if record.get('failures'):
+        timeout = timeout / (1 + record['failures'])
+    return max(MIN_TIMEOUT, min(limit, timeout))
+
+
+def host_skip_reason(host):
+    """Why requests to a host are skipped right now, None if they are not"""
+    record = load_host_health().get(host, {})
+    skip_until = record.get('skip_until', 0)
+    if skip_until > time.time():
+        until = datetime.datetime.fromtimestamp(skip_until).strftime('%Y-%m-%d %H:%M')
+        return f"failed {record['failures']} runs in a row, skipped until {until}"
+    return None
+
+
+def record_host_result(host, ok, elapsed=None):
+    """
+    Update the latency average of a host and count the request for this run
+    
+    Failures only count once per run, see save_host_health(), so a few
+    failed image requests do not get a host skipped.
+    """
+    health = load_host_health()
+    with _host_health_lock:
+        record = health.setdefault(host, {'failures': 0})
+        record['last_seen'] = int(time.time())
+        _host_run_results.setdefault(host, [0, 0])[0 if ok else 1] += 1
+        if ok and elapsed is not None:
+            # Exponential moving average of the response time
+            latency = record.get('latency')
+            record['latency'] = round(elapsed if latency is None else 0.7 * latency + 0.3 * elapsed, 3)
+
+
+def guarded_get(url, limit, share=1.0, **kwargs):
+    """
+    GET a URL through the shared session, unless its host is skipped or time is up
+    
+    The timeout adapts to the host's history and never runs past the
+    given share of the run deadline. Connection errors, timeouts, 5xx
+    and 429 answers count as failures of the host.
+    
+    Args:
+        url: URL to fetch
+        limit: Longest timeout in seconds
+        share: Share of RUN_DEADLINE by which the request must be done
+        
+    Returns:
+        requests.Response
+        
+    Raises:
+        HostUnavailable: The host is skipped or the deadline has passed
+    """
+    host = urlparse(url).netloc.lower()
+    reason = host_skip_reason(host)
+    if reason:
+        metrics.count('requests_skipped_host')
+        raise HostUnavailable(f"{host} {reason}")
+    
+    timeout = host_timeout(host, limit)
+    left = time_left(share)
+    cut_by_deadline = False
+    if left is not None:
+        if left <= 0:
+            metrics.count('requests_skipped_deadline')
+            raise HostUnavailable("run deadline reached")
+        cut_by_deadline = left < timeout
+        timeout = min(timeout, left)
+    
+    start = time.monotonic()
+    try:
+        response = get_http_session().get(url, timeout=(min(CONNECT_TIMEOUT, timeout), timeout), **kwargs)
+    except Exception:
+        # A timeout shortened by the deadline says nothing about the host
+        if not cut_by_deadline:
+            record_host_result(host, False)
+        raise
+    ok = response.status_code < 500 and response.status_code != 429
+    record_host_result(host, ok, time.monotonic() - start)
+    return response
+
+
+class RunMetrics:
+    """
+    Thread-safe timers, counters and per-feed records of one run
+    
+    Stages are sequential steps timed by wall clock. Timers add up the
+    time spent in an operation across all worker threads, so they can
+    exceed the wall time of the stage they run in.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.stages = {}
+        self.timers = {}
+        self.counters = {}
+        self.feeds = {}
+        self.errors = []
+        self.imports = {}
+    
+    @contextlib.contextmanager
+    def stage(self, name):
+        """Time a sequential stage of the run"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.stages[name] = self.stages.get(name, 0.0) + elapsed
+    
+    @contextlib.contextmanager
+    def timer(self, name):
+        """Add the duration of an operation to a cumulative timer"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                total, count = self.timers.get(name, (0.0, 0))
+                self.timers[name] = (total + elapsed, count + 1)
+    
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+    
+    def feed(self, url, **values):
+        """Update the record of a single feed"""
+        with self.lock:
+            self.feeds.setdefault(url, {'url': url}).update(values)
+    
+    def imported(self, name, seconds):
+        """Record the load time of a lazily imported module"""
+        with self.lock:
+            self.imports.setdefault(name, seconds)
+    
+    def error(self, where, message):
+        with self.lock:
+            self.errors.append({'where': where, 'message': str(message)})
+            self.counters[f'errors.{where}'] = self.counters.get(f'errors.{where}', 0) + 1
+    
+    def summary(self, **extra):
+        """Machine-readable summary of the run"""
+        with self.lock:
+            summary = {
+                'started': datetime.datetime.fromtimestamp(self.started).isoformat(timespec='seconds'),
+                'duration_s': round(time.time() - self.started, 3),
+                'stages_s': {name: round(seconds, 3) for name, seconds in self.stages.items()},
+                'timers': {name: {'total_s': round(total, 3), 'count': count}
+                           for name, (total, count) in self.timers.items()},
+                'counters': dict(self.counters),
+                'imports_s': {name: round(seconds, 3) for name, seconds in self.imports.items()},
+                'feeds': list(self.feeds.values()),
+                'errors': list(self.errors),
+            }
+        summary['http'] = http_stats()
+        summary.update(extra)
+        return summary
+    
+    def write_summary(self, path, **extra):
+        """Write the summary as JSON"""
+        try:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            with open(path + ".tmp", 'w') as f:
+                json.dump(self.summary(**extra), f, indent=2, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+            print(f"Run summary written to: {path}")
+        except OSError as e:
+            print(f"Could not write run summary: {e}")
+
+
+metrics = RunMetrics()
+
+
+def parse_duration(value):
+    """Parse an age like 3d, 12h or 30m into seconds, a plain number means days"""
+    units = {'d': 86400, 'h': 3600, 'm': 60, 's': 1}
+    text = value.strip().lower()
+    if text and text[-1] in units:
+        seconds = float(text[:-1]) * units[text[-1]]
+    else:
+        seconds = float(text) * units['d']
+    if seconds <= 0:
+        raise ValueError(f"expected a positive age, got {value!r}")
+    return seconds
+
+
+def _parse_flag(value):
+    if value.lower() in ('1', 'yes', 'true', 'on'):
+        return True
+    if value.lower() in ('0', 'no', 'false', 'off'):
+        return False
+    raise ValueError(f"expected yes or no, got {value!r}")
+
+
+def _parse_limit(value):
+    limit = int(value)
+    if limit < 0:
+        raise ValueError(f"expected a number >= 0, got {value!r}")
+    return limit
+
+
+# Parsers of the options allowed after a feed URL in config
+FEED_OPTION_PARSERS = {
+    'max_entries': _parse_limit,
+    'max_images': _parse_limit,
+    'max_bytes': lambda value: parse_bytes(value),
+    'max_age': parse_duration,
+    'text_only': _parse_flag,
+    'full_text': _parse_flag,
+}
+
+
+def _parse_choice(*choices):
+    def parse(value):
+        if value.lower() not in choices:
+            raise ValueError(f"expected one of {', '.join(choices)}, got {value!r}")
+        return value.lower()
+    return parse
+
+
+def _parse_zip_level(value):
+    level = int(value)
+    if not 1 <= level <= 9:
+        raise ValueError(f"expected a level from 1 to 9, got {value!r}")
+    return level
+
+
+# Parsers of the options allowed after a profile name, and the setting each one replaces
+PROFILE_OPTION_PARSERS = {
+    'output_dir': os.path.expanduser,
+    'language': str,
+    'image_resize': _parse_choice('screen', 'scale'),
+    'max_image_size': lambda value: parse_size(value),
+    'image_encoding': _parse_choice('color', 'grayscale', 'eink'),
+    'split': _parse_choice('none', 'feed', 'size'),
+    'volume_size': lambda value: parse_bytes(value),
+    'volume_chapters': _parse_limit,
+    'chapter_size': lambda value: parse_bytes(value),
+    'zip_policy': _parse_choice('auto', 'deflate', 'store'),
+    'zip_level': _parse_zip_level,
+}
+PROFILE_SETTINGS = {
+    'output_dir': 'OUTPUT_DIR',
+    'language': 'LANGUAGE',
+    'image_resize': 'IMAGE_RESIZE_MODE',
+    'max_image_size': 'IMAGE_MAX_SIZE',
+    'image_encoding': 'IMAGE_ENCODING',
+    'split': 'SPLIT_MODE',
+    'volume_size': 'VOLUME_MAX_BYTES',
+    'volume_chapters': 'VOLUME_MAX_CHAPTERS',
+    'chapter_size': 'CHAPTER_TARGET_BYTES',
+    'zip_policy': 'ZIP_POLICY',
+    'zip_level': 'ZIP_LEVEL',
+}
+
+
+def parse_config_line(line, parsers=None):
+    """
+    Parse one config line: a feed URL optionally followed by options
+    
+    Options are key=value words, a bare key turns a flag on:
+        https://example.com/feed max_entries=5 max_age=2d text_only
+    Text after " #" is a comment. Invalid options are reported and ignored.
+    
+    Args:
+        line: Line of the config (or profiles) file
+        parsers: Allowed options and their parsers (defaults to FEED_OPTION_PARSERS)
+    
+    Returns:
+        (url, options) tuple, or None for blank and comment lines
+    """
+    parsers = parsers or FEED_OPTION_PARSERS
+    line = re.split(r'\s#', line, maxsplit=1)[0].strip()
+    if not line or line.startswith('#'):
+        return None
+    url, *words = line.split()
+    options = {}
+    for word in words:
+        key, has_value, value = word.partition('=')
+        key = key.strip().lower().replace('-', '_')
+        if key not in parsers:
+            print(f"Warning: unknown option {key!r} for {url}, ignored")
+            continue
+        try:
+            options[key] = parsers[key](value if has_value else 'yes')
+        except (ValueError, argparse.ArgumentTypeError) as e:
+            print(f"Warning: invalid value for {key} of {url}: {e}")
+    return url, options
+
+
+def feed_options(url):
+    """Options of a feed from config, with defaults for options not given"""
+    options = dict(DEFAULT_FEED_OPTIONS)
+    options.update(FEED_OPTIONS.get(url, {}))
+    return options
+
+
+def read_config(config_path=None):
+    """
+    Read RSS links from config file in the same directory
+    
+    Options given after a link are stored in FEED_OPTIONS.
+    """
     print("Reading config file...")
-    config_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config")
+    config_path = config_path or CONFIG_PATH
     
     if not os.path.exists(config_path):
         print("Error: Config file not found at", config_path)
         return []
     
+    links = []
+    FEED_OPTIONS.clear()
     with open(config_path, 'r') as f:
-        links = [line.strip() for line in f.readlines() if line.strip() and not line.startswith('#')]
-        print(f"Found {len(links)} RSS links in config file")
-        return links
+        for line in f:
+            parsed = parse_config_line(line)
+            if parsed is None:
+                continue
+            url, options = parsed
+            links.append(url)
+            if options:
+                FEED_OPTIONS[url] = options
+                print(f"Options for {url}: {options}")
+    print(f"Found {len(links)} RSS links in config file")
+    return links
+
+
+def default_profile():
+    """The output profile given by the command line, as (name, settings)"""
+    return None, {name: globals()[name] for name in PROFILE_SETTINGS.values()}
+
+
+def read_profiles(profiles_path=None):
+    """
+    Read output profiles: a name followed by options on each line
+    
+        eink output_dir=/mnt/onboard/RSS/eink image_encoding=eink language=en
+    
+    Options not given keep their command line value. A profile writing
+    to the same directory as an earlier one is skipped, the EPUBs of
+    the same day would overwrite each other.
+    
+    Returns:
+        List of (name, settings) tuples, settings map module settings to
+        their values in the profile
+    """
+    profiles_path = profiles_path or RENDER_PROFILES_PATH
+    if not os.path.exists(profiles_path):
+        print("Error: Profiles file not found at", profiles_path)
+        return []
+    
+    profiles = []
+    output_dirs = set()
+    with open(profiles_path, 'r') as f:
+        for line in f:
+            parsed = parse_config_line(line, PROFILE_OPTION_PARSERS)
+            if parsed is None:
+                continue
+            name, options = parsed
+            settings = default_profile()[1]
+            settings.update((PROFILE_SETTINGS[key], value) for key, value in options.items())
+            output_dir = os.path.abspath(settings['OUTPUT_DIR'])
+            if output_dir in output_dirs:
+                print(f"Warning: profile {name} writes to {output_dir} like an earlier profile, skipped")
+                continue
+            output_dirs.add(output_dir)
+            profiles.append((name, settings))
+            print(f"Profile {name}: {options}")
+    print(f"Found {len(profiles)} output profiles")
+    return profiles
+
+
+def profile_image_settings(settings):
+    """Image processing settings of a profile, see image_settings()"""
+    return settings['IMAGE_RESIZE_MODE'], tuple(settings['IMAGE_MAX_SIZE']), settings['IMAGE_ENCODING']
+
+
+@contextlib.contextmanager
+def applied_settings(settings):
+    """Use the settings of a profile while the block runs"""
+    saved = {name: globals()[name] for name in settings}
+    globals().update(settings)
+    try:
+        yield
+    finally:
+        globals().update(saved)
+
+
+def entry_timestamp(entry):
+    """Publication (or update) time of an entry as a Unix timestamp, None if unknown"""
+    parsed = entry.get('published_parsed') or entry.get('updated_parsed')
+    if not parsed:
+        return None
+    return calendar.timegm(parsed)
+
+
+def entry_content(entry):
+    """Raw HTML of an entry: full content, then description"""
+    if entry.get('content'):
+        return entry.content[0].value
+    return entry.get('description', '')
+
+
+class Entry:
+    """
+    One article, reduced to the fields the EPUB is built from
+    
+    Entries are normalized once after parsing and cached in that form,
+    so later stages and runs never need feedparser's objects.
+    """
+    __slots__ = ('id', 'title', 'link', 'published', 'timestamp', 'content')
+    
+    def __init__(self, id, title, link, published, timestamp, content):
+        self.id = id
+        self.title = title
+        self.link = link
+        self.published = published
+        self.timestamp = timestamp
+        self.content = content
+
+
+class Feed:
+    """A fetched feed: its URL, title, normalized entries and config options"""
+    __slots__ = ('url', 'title', 'entries', 'options')
+    
+    def __init__(self, url, title=None, entries=None, options=None):
+        self.url = url
+        self.title = title
+        self.entries = entries if entries is not None else []
+        self.options = options
+
+
+def normalize_feed(url, parsed):
+    """Turn a feedparser result into a Feed of Entry records"""
+    entries = [
+        Entry(
+            id=article_id(entry),
+            title=entry.get('title') or 'Untitled',
+            link=entry.get('link', ''),
+            published=entry.get('published'),
+            timestamp=entry_timestamp(entry),
+            content=entry_content(entry),
+        )
+        for entry in parsed.entries
+    ]
+    return Feed(url, parsed.feed.get('title'), entries)
+
+
+def apply_feed_budget(url, feed):
+    """
+    Trim a parsed feed to the limits set for it in config
+    
+    Runs right after parsing, before any HTML cleaning or image work.
+    Entries older than max_age are dropped (entries without a date are
+    kept), then only the newest max_entries are kept, then entries are
+    kept while their article text fits in max_bytes (the first entry is
+    always kept). Images are budgeted later in apply_image_budgets().
+    
+    Returns:
+        Number of entries dropped
+    """
+    options = feed_options(url)
+    # Options travel with the feed to the stages that need them
+    feed.options = options
+    entries = feed.entries
+    before = len(entries)
+    
+    if options['max_age']:
+        oldest = time.time() - options['max_age']
+        entries = [entry for entry in entries if entry.timestamp is None or entry.timestamp >= oldest]
+    
+    entries = entries[:options['max_entries']]
+    
+    if options['max_bytes']:
+        kept, used = [], 0
+        for entry in entries:
+            size = len(entry.content.encode('utf-8'))
+            if kept and used + size > options['max_bytes']:
+                break
+            kept.append(entry)
+            used += size
+        entries = kept
+    
+    feed.entries = entries
+    dropped = before - len(entries)
+    if dropped:
+        metrics.count('entries_over_budget', dropped)
+    return dropped
+
+
+def open_feed_cache():
+    """
+    Open the cache of normalized feeds, creating it if needed
+    
+    Feeds are stored with their validators (ETag / Last-Modified), a
+    hash of the response body and their entries as rows, article HTML
+    compressed with zlib. The single connection is shared by the fetch
+    threads under _feed_cache_lock.
+    """
+    global _feed_cache_db
+    with _feed_cache_lock:
+        if _feed_cache_db is None:
+            os.makedirs(os.path.dirname(FEED_CACHE_PATH), exist_ok=True)
+            conn = sqlite3.connect(FEED_CACHE_PATH, check_same_thread=False)
+            conn.execute("""CREATE TABLE IF NOT EXISTS feeds (
+                url TEXT PRIMARY KEY, title TEXT, etag TEXT, last_modified TEXT, last_used REAL, body_hash TEXT)""")
+            if 'body_hash' not in [column[1] for column in conn.execute("PRAGMA table_info(feeds)")]:
+                # Caches written before body hashes were stored
+                conn.execute("ALTER TABLE feeds ADD COLUMN body_hash TEXT")
+            conn.execute("""CREATE TABLE IF NOT EXISTS entries (
+                feed_url TEXT, position INTEGER, id TEXT, title TEXT, link TEXT,
+                published TEXT, timestamp INTEGER, content BLOB,
+                PRIMARY KEY (feed_url, position)) WITHOUT ROWID""")
+            # Extracted article pages, content is NULL when nothing could be extracted
+            conn.execute("""CREATE TABLE IF NOT EXISTS articles (
+                url TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, fetched REAL, last_used REAL, content BLOB)""")
+            conn.commit()
+            _feed_cache_db = conn
+        return _feed_cache_db
+
+
+def get_feed_validators(url):
+    """Return (etag, last_modified) stored for a URL, or None"""
+    conn = open_feed_cache()
+    with _feed_cache_lock:
+        return conn.execute("SELECT etag, last_modified FROM feeds WHERE url = ?", (url,)).fetchone()
+
+
+def save_feed_cache():
+    """Evict least recently used feeds and article extracts, then close the feed cache"""
+    global _feed_cache_db
+    with _feed_cache_lock:
+        if _feed_cache_db is None:
+            return
+        conn = _feed_cache_db
+        try:
+            evicted = [row[0] for row in conn.execute(
+                "SELECT url FROM feeds ORDER BY last_used DESC LIMIT -1 OFFSET ?", (FEED_CACHE_MAX_ENTRIES,))]
+            for url in evicted:
+                conn.execute("DELETE FROM entries WHERE feed_url = ?", (url,))
+                conn.execute("DELETE FROM feeds WHERE url = ?", (url,))
+            conn.execute("DELETE FROM articles WHERE url IN (SELECT url FROM articles ORDER BY last_used DESC "
+                         "LIMIT -1 OFFSET ?)", (FULL_TEXT_CACHE_MAX_ENTRIES,))
+            conn.commit()
+        except sqlite3.Error as e:
+            print(f"Could not save feed cache: {e}")
+        conn.close()
+        _feed_cache_db = None
+
+
+def get_cached_feed(url, body_hash=None):
+    """
+    Return the stored normalized feed for a URL without parsing anything, or None
+    
+    Args:
+        body_hash: Hash of a new response body, see feed_body_hash(). The
+            stored feed is only returned when it was made from the same body
+    """
+    conn = open_feed_cache()
+    try:
+        with _feed_cache_lock:
+            row = conn.execute("SELECT title, body_hash FROM feeds WHERE url = ?", (url,)).fetchone()
+            if row is None or (body_hash is not None and row[1] != body_hash):
+                return None
+            rows = conn.execute(
+                "SELECT id, title, link, published, timestamp, content FROM entries "
+                "WHERE feed_url = ? ORDER BY position", (url,)).fetchall()
+            conn.execute("UPDATE feeds SET last_used = ? WHERE url = ?", (time.time(), url))
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"Could not read cached feed {url}: {e}")
+        return None
+    entries = [Entry(entry_id, title, link, published, timestamp, zlib.decompress(content).decode('utf-8'))
+               for entry_id, title, link, published, timestamp, content in rows]
+    return Feed(url, row[0], entries)
+
+
+def feed_body_hash(response):
+    """Hash of a feed response body, to recognize an unchanged feed sent without validators"""
+    return hashlib.sha1(response.content).hexdigest()
+
+
+def store_cached_feed(url, response, feed):
+    """Store the response validators, body hash and the normalized feed for a URL"""
+    conn = open_feed_cache()
+    try:
+        with _feed_cache_lock:
+            conn.execute("DELETE FROM entries WHERE feed_url = ?", (url,))
+            conn.execute("INSERT OR REPLACE INTO feeds (url, title, etag, last_modified, last_used, body_hash) "
+                         "VALUES (?, ?, ?, ?, ?, ?)",
+                         (url, feed.title, response.headers.get('ETag'), response.headers.get('Last-Modified'),
+                          time.time(), feed_body_hash(response)))
+            conn.executemany(
+                "INSERT INTO entries (feed_url, position, id, title, link, published, timestamp, content) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(url, position, entry.id, entry.title, entry.link, entry.published, entry.timestamp,
+                  zlib.compress(entry.content.encode('utf-8')))
+                 for position, entry in enumerate(feed.entries)])
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"Could not cache feed {url}: {e}")
+
+
+def update_feed_validators(url, response):
+    """Store new validators for a feed whose body did not change"""
+    conn = open_feed_cache()
+    try:
+        with _feed_cache_lock:
+            conn.execute("UPDATE feeds SET etag = ?, last_modified = ? WHERE url = ?",
+                         (response.headers.get('ETag'), response.headers.get('Last-Modified'), url))
+            conn.commit()
+    except sqlite3.Error as e:
+        print(f"Could not cache feed {url}: {e}")
+
+
+def empty_feed(url=None):
+    """Feed without entries, used when a feed cannot be fetched"""
+    return Feed(url)
 
 
 def fetch_rss_content(url):
-    """Fetch and parse RSS feed content"""
+    """
+    Fetch and parse RSS feed content
+    
+    Unchanged feeds, answered with HTTP 304 or with the same body as last
+    time, come from the feed cache without being parsed again.
+    
+    Returns:
+        Feed with normalized entries, empty if the feed could not be fetched
+    """
     print(f"Fetching RSS from: {url}")
     
-    # Add headers to simulate a browser request
+    # The shared session already sends a browser User-Agent
     headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
         'Accept': 'application/rss+xml, application/xml, text/xml, */*'
     }
     
+    # Send validators from the last successful fetch
+    validators = get_feed_validators(url)
+    if validators:
+        etag, last_modified = validators
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+    
     try:
         # First try to get the raw content with requests
-        response = requests.get(url, headers=headers, timeout=30)
+        with metrics.timer('feed_http'):
+            response = guarded_get(url, FEED_TIMEOUT, FETCH_DEADLINE_SHARE, headers=headers)
         print(f"HTTP status code: {response.status_code}")
         
-        if response.status_code != 200:
-            print(f"Warning: HTTP error {response.status_code} when accessing {url}")
-            return feedparser.FeedParserDict({'entries': []})
-        
-        # Pass the raw content to feedparser
-        feed = feedparser.parse(response.content)
+        feed = None
+        if response.status_code == 304:
+            feed = get_cached_feed(url)
+            if feed is not None:
+                print(f"Feed not modified, reusing cached copy: {url}")
+                metrics.count('feed_cache_hits')
+                metrics.feed(url, cached=True)
+            else:
+                # Validators without a stored copy, fetch the full feed again
+                headers.pop('If-None-Match', None)
+                headers.pop('If-Modified-Since', None)
+                with metrics.timer('feed_http'):
+                    response = guarded_get(url, FEED_TIMEOUT, FETCH_DEADLINE_SHARE, headers=headers)
+                print(f"HTTP status code: {response.status_code}")
+        metrics.feed(url, status=response.status_code, bytes=len(response.content))
+        metrics.count('feed_bytes', len(response.content))
         
-        # Check if we got a valid feed
-        if 'status' in feed and feed.status != 200:
-            print(f"Warning: Feed status {feed.status} for {url}")
+        if feed is None:
+            if response.status_code != 200:
+                print(f"Warning: HTTP error {response.status_code} when accessing {url}")
+                metrics.error('fetch', f"HTTP {response.status_code} for {url}")
+                return empty_feed(url)
+            
+            # Servers without validators resend the whole feed, an unchanged body is not parsed again
+            feed = get_cached_feed(url, feed_body_hash(response))
+            if feed is not None:
+                print(f"Feed body unchanged, reusing cached copy: {url}")
+                update_feed_validators(url, response)
+                metrics.count('feed_cache_hits')
+                metrics.feed(url, cached=True)
         
-        if not feed.entries:
-            print(f"Warning: No entries found in feed: {url}")
-            print(f"Feed structure: {feed.keys()}")
-            if 'bozo_exception' in feed:
-                print(f"Feed parser exception: {feed.bozo_exception}")
-            return feed
+        if feed is None:
+            # Pass the raw content to feedparser
+            feedparser = lazy_import('feedparser')
+            with metrics.timer('feedparser'):
+                parsed = feedparser.parse(response.content)
+            
+            if not parsed.entries:
+                print(f"Warning: No entries found in feed: {url}")
+                print(f"Feed structure: {parsed.keys()}")
+                if 'bozo_exception' in parsed:
+                    print(f"Feed parser exception: {parsed.bozo_exception}")
+                return empty_feed(url)
+            
+            feed = normalize_feed(url, parsed)
+            del parsed
+            store_cached_feed(url, response, feed)
         
         # Print some debug info about the feed
         print(f"Feed contains {len(feed.entries)} entries")
-        print(f"Feed title: {feed.feed.get('title', 'Unknown')}")
+        print(f"Feed title: {feed.title or 'Unknown'}")
+        metrics.feed(url, title=feed.title)
         
-        # Limit to just 5 most recent entries
-        feed.entries = feed.entries[:10]
+        # Limit entries to the feed's budget from config (10 newest by default)
+        apply_feed_budget(url, feed)
         print(f"Retrieved {len(feed.entries)} entries from {url}")
         return feed
         
     except Exception as e:
         print(f"Error fetching {url}: {e}")
+        metrics.error('fetch', f"{url}: {e}")
         # Return an empty feed
-        return feedparser.FeedParserDict({'entries': []})
+        return empty_feed(url)
 
 
-def clean_html(html_content):
-    """Clean HTML content, keep main text and images"""
-    if not html_content:
-        return ""
-    soup = BeautifulSoup(html_content, 'html.parser')
+def host_limiter(max_per_host):
+    """
+    Create a per-host concurrency limit
     
-    # Remove script and style elements
-    for script in soup(["script", "style"]):
-        script.decompose()
+    Returns:
+        Function mapping a URL to the semaphore guarding its host
+    """
+    host_slots = {}
+    host_slots_lock = threading.Lock()
     
-    return str(soup)
+    def host_slot(url):
+        host = urlparse(url).netloc.lower()
+        with host_slots_lock:
+            if host not in host_slots:
+                host_slots[host] = threading.BoundedSemaphore(max_per_host)
+            return host_slots[host]
+    
+    return host_slot
 
 
-def download_images(html_content, book, feed_title):
-    """Download images in HTML content and replace with local paths"""
-    soup = BeautifulSoup(html_content, 'html.parser')
-    images = soup.find_all('img')
+def fetch_all_feeds(links, max_workers=MAX_FETCH_WORKERS, max_per_host=MAX_CONNECTIONS_PER_HOST):
+    """
+    Fetch RSS feeds concurrently with a bounded thread pool and a per-host limit
     
-    for i, img in enumerate(images):
-        try:
-            img_url = img.get('src')
-            if not img_url:
-                continue
-                
-            # Handle relative URLs
-            if not img_url.startswith(('http://', 'https://')):
-                parsed_url = urlparse(img_url)
-                if not parsed_url.netloc:
-                    base_url = img.get('data-src')
-                    if base_url:
-                        img_url = base_url
-            
-            print(f"Downloading image: {img_url}")
-            # Download image
-            img_resp = requests.get(img_url, headers={
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-            }, timeout=10)
-            
-            if img_resp.status_code == 200:
-                # Process and resize image
-                try:
-                    from PIL import Image
-                    import io
-                    
-                    # Load image from response content
-                    original_image = Image.open(io.BytesIO(img_resp.content))
-                    
-                    # Get original size
-                    original_width, original_height = original_image.size
-                    print(f"Original image size: {original_width}x{original_height}")
-                    
-                    # Calculate new size (30% of original)
-                    new_width = int(original_width * 0.3)
-                    new_height = int(original_height * 0.3)
-                    
-                    # Resize image
-                    resized_image = original_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
-                    print(f"Resized image to: {new_width}x{new_height}")
-                    
-                    # Save resized image to bytes
-                    img_bytes = io.BytesIO()
-                    
-                    # Determine format and save
-                    if original_image.format in ['JPEG', 'JPG']:
-                        # Convert RGBA to RGB if necessary for JPEG
-                        if resized_image.mode == 'RGBA':
-                            rgb_image = Image.new('RGB', resized_image.size, (255, 255, 255))
-                            rgb_image.paste(resized_image, mask=resized_image.split()[-1])
-                            resized_image = rgb_image
-                        resized_image.save(img_bytes, format='JPEG', quality=85, optimize=True)
-                        img_filename = f"image_{feed_title.replace(' ', '_')}_{i}.jpg"
-                        media_type = 'image/jpeg'
-                    else:
-                        # Save as PNG for other formats
-                        resized_image.save(img_bytes, format='PNG', optimize=True)
-                        img_filename = f"image_{feed_title.replace(' ', '_')}_{i}.png"
-                        media_type = 'image/png'
-                    
-                    resized_content = img_bytes.getvalue()
-                    
-                    # Add resized image to ebook
-                    img_item = epub.EpubItem(
-                        uid=f'image_{feed_title}_{i}',
-                        file_name=f'images/{img_filename}',
-                        media_type=media_type,
-                        content=resized_content
-                    )
-                    book.add_item(img_item)
-                    
-                    # 强制居中：包装图片在div容器中
-                    img_parent = img.parent
-                    new_div = soup.new_tag('div', **{'class': 'image-container', 'style': 'text-align: center; margin: 1em 0;'})
-                    new_img = soup.new_tag('img', src=f'images/{img_filename}', alt=img.get('alt', ''), style='max-width: 100%; height: auto; display: block; margin: 0 auto;')
-                    
-                    new_div.append(new_img)
-                    img.replace_with(new_div)
-                    
-                    print(f"Resized image saved as: {img_filename}")
-                    
-                except Exception as resize_error:
-                    print(f"Failed to resize image, using original: {resize_error}")
-                    # Fallback to original image if resize fails
-                    img_filename = f"image_{feed_title.replace(' ', '_')}_{i}.jpg"
-                    img_item = epub.EpubItem(
-                        uid=f'image_{feed_title}_{i}',
-                        file_name=f'images/{img_filename}',
-                        media_type='image/jpeg',
-                        content=img_resp.content
-                    )
-                    book.add_item(img_item)
-                    
-                    # 强制居中：包装图片在div容器中
-                    img_parent = img.parent
-                    new_div = soup.new_tag('div', **{'class': 'image-container', 'style': 'text-align: center; margin: 1em 0;'})
-                    new_img = soup.new_tag('img', src=f'images/{img_filename}', alt=img.get('alt', ''), style='max-width: 100%; height: auto; display: block; margin: 0 auto;')
-                    
-                    new_div.append(new_img)
-                    img.replace_with(new_div)
-                    
-                    print(f"Original image saved as: {img_filename}")
-                    
-        except Exception as e:
-            print(f"Failed to download image: {e}")
+    Args:
+        links: RSS links in config order
+        max_workers: Maximum number of feeds fetched at the same time
+        max_per_host: Maximum number of concurrent requests against one host
+        
+    Returns:
+        List of (link, feed, elapsed_seconds) tuples in config order
+    """
+    host_slot = host_limiter(max_per_host)
+    
+    def fetch_one(link):
+        with host_slot(link):
+            start = time.perf_counter()
+            try:
+                feed = fetch_rss_content(link)
+            except Exception as e:
+                print(f"Error processing feed {link}: {e}")
+                metrics.error('fetch', f"{link}: {e}")
+                feed = empty_feed(link)
+            elapsed = time.perf_counter() - start
+            metrics.feed(link, seconds=round(elapsed, 3), entries=len(feed.entries))
+            return feed, elapsed
+    
+    print(f"Fetching {len(links)} feeds with up to {max_workers} workers ({max_per_host} per host)...")
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(links)))) as executor:
+        # map() yields results in submission order, so config order is preserved
+        results = [(link, feed, elapsed) for link, (feed, elapsed)
+                   in zip(links, executor.map(fetch_one, links))]
+    total = time.perf_counter() - start
+    save_feed_cache()
+    
+    print("Feed fetch timings:")
+    for link, feed, elapsed in results:
+        print(f"  {elapsed:6.2f}s  {len(feed.entries):3d} entries  {link}")
+    print(f"Fetched {len(links)} feeds in {total:.2f}s "
+          f"(sum of feed times {sum(r[2] for r in results):.2f}s)")
+    return results
+
+
+def _detect_html_parser():
+    """Use lxml for BeautifulSoup when it is installed, html.parser otherwise"""
+    # find_spec() only looks the package up, lxml itself is loaded with bs4
+    if importlib.util.find_spec('lxml') is not None:
+        return 'lxml'
+    return 'html.parser'
+
+
+HTML_PARSER = _detect_html_parser()
+
+# Elements dropped from articles of text-only feeds
+TEXT_ONLY_REMOVED_TAGS = ('picture', 'figure', 'video', 'audio', 'iframe', 'object', 'embed', 'svg')
+# Attributes lazy-loading pages use for the real image URL
+LAZY_IMAGE_ATTRIBUTES = ('data-src', 'data-original', 'data-lazy-src')
+# Comment left in cleaned HTML where an image is attached later
+IMAGE_PLACEHOLDER = 'rss-image:{}'
+IMAGE_PLACEHOLDER_PATTERN = re.compile(r'<!--rss-image:(\d+)-->')
+
+
+def _absolute_url(url, base_url):
+    """Resolve a possibly relative or protocol-relative URL against the article link"""
+    url = url.strip()
+    if url.startswith(('http://', 'https://')):
+        return url
+    if base_url:
+        return urljoin(base_url, url)
+    if url.startswith('//'):
+        return 'https:' + url
+    return url
+
+
+def clean_html(html_content, base_url=None, max_images=None, text_only=False):
+    """
+    Clean HTML content in a single parse, keep main text and images
+    
+    Script and style elements are removed, links are made absolute and
+    downloadable images are collected, all in one pass over the tree.
+    Collected images are replaced by placeholder comments that
+    attach_images() fills in later, so the parsed tree can be dropped
+    right away.
+    
+    Args:
+        html_content: Article HTML
+        base_url: Article link used to resolve relative URLs
+        max_images: Images kept, later ones are removed (None keeps all)
+        text_only: Remove images and embedded media altogether
+        
+    Returns:
+        (html, images) where images is a list of
+        (image_url, alt_text, original_markup) tuples in document order
+    """
+    bs4 = lazy_import('bs4')
+    soup = bs4.BeautifulSoup(html_content or "", HTML_PARSER)
+    images = []
+    
+    removed = ('script', 'style') + (TEXT_ONLY_REMOVED_TAGS if text_only else ())
+    if text_only:
+        max_images = 0
+    
+    for tag in soup.find_all(list(removed) + ['img', 'a']):
+        if tag.decomposed:
+            # Inside an element removed earlier in this loop
+            continue
+        if tag.name in removed:
+            # Remove script and style elements (and media in text-only mode)
+            tag.decompose()
+        elif tag.name == 'a':
+            href = tag.get('href')
+            if href and not href.startswith(('#', 'mailto:', 'javascript:')):
+                tag['href'] = _absolute_url(href, base_url)
+        else:
+            img_url = tag.get('src')
+            lazy_url = next((tag.get(name) for name in LAZY_IMAGE_ATTRIBUTES if tag.get(name)), None)
+            # Prefer the lazy-load URL over a missing, inline or relative placeholder
+            if lazy_url and (not img_url or not img_url.startswith(('http://', 'https://'))):
+                img_url = lazy_url
+            if not img_url or img_url.startswith('data:'):
+                continue
+            if _declared_tracking_pixel(tag):
+                metrics.count('images_dropped_tiny')
+                tag.decompose()
+                continue
+            if max_images is not None and len(images) >= max_images:
+                tag.decompose()
+                continue
+            images.append((_absolute_url(img_url, base_url), tag.get('alt', ''), str(tag)))
+            tag.replace_with(bs4.Comment(IMAGE_PLACEHOLDER.format(len(images) - 1)))
+    
+    return render_html(soup), images
+
+
+def _declared_tracking_pixel(tag):
+    """True if an <img> declares a width or height below IMAGE_MIN_SIDE"""
+    for name in ('width', 'height'):
+        value = (tag.get(name) or '').strip().lower()
+        if value.endswith('px'):
+            value = value[:-2]
+        if value.isdigit() and int(value) < IMAGE_MIN_SIDE:
+            return True
+    return False
+
+
+def render_html(soup):
+    """Serialize cleaned HTML without the <html>/<body> wrapper some parsers add"""
+    if soup.body is not None:
+        return soup.body.decode_contents()
+    return str(soup)
+
+
+class ImageByteBudget:
+    """Bytes the image downloads of one run (or one feed) may still use, shared by the download threads"""
+    
+    def __init__(self, limit):
+        self.lock = threading.Lock()
+        self.left = limit
+    
+    def take(self, size):
+        """Reserve size bytes, return False once the budget is spent"""
+        with self.lock:
+            if self.left is None:
+                return True
+            if size > self.left:
+                self.left = 0
+                return False
+            self.left -= size
+            return True
+
+
+def probe_image(data):
+    """
+    Read format and dimensions from the first bytes of an image
+    
+    Returns:
+        (format, width, height) tuple, or None if the header is not complete
+        or not recognized
+    """
+    Image = lazy_import('PIL.Image')
+    try:
+        image = Image.open(io.BytesIO(bytes(data)))
+        return image.format, image.size[0], image.size[1]
+    except Exception:
+        return None
+
+
+def image_drop_reason(probe):
+    """Why an image with the probed format and size is left out, or None to keep it"""
+    image_format, width, height = probe
+    if width < IMAGE_MIN_SIDE or height < IMAGE_MIN_SIDE:
+        return 'tiny'
+    if image_format != 'JPEG' and width * height > IMAGE_MAX_PIXELS:
+        return 'oversized'
+    return None
+
+
+def _skip_gif_sub_blocks(data, pos):
+    """Offset past a chain of GIF data sub-blocks, or None if it is incomplete"""
+    while pos < len(data):
+        size = data[pos]
+        pos += 1 + size
+        if size == 0:
+            return pos
+    return None
+
+
+def gif_first_frame_end(data):
+    """
+    Offset just past the first image of a GIF
+    
+    Returns:
+        Offset, or None if the first image has not been received completely
+        
+    Raises:
+        ValueError: The data is not a GIF stream this parser understands
+    """
+    if len(data) < 13:
+        return None
+    if data[:6] not in (b'GIF87a', b'GIF89a'):
+        raise ValueError("not a GIF")
+    pos = 13
+    if data[10] & 0x80:
+        # Global color table
+        pos += 3 * (2 << (data[10] & 7))
+    while pos < len(data):
+        block = data[pos]
+        if block == 0x21:
+            # Extension: label, then data sub-blocks
+            pos = _skip_gif_sub_blocks(data, pos + 2)
+            if pos is None:
+                return None
+        elif block == 0x2C:
+            # Image descriptor, optional local color table, LZW code size, image data
+            if pos + 10 > len(data):
+                return None
+            flags = data[pos + 9]
+            pos += 10
+            if flags & 0x80:
+                pos += 3 * (2 << (flags & 7))
+            return _skip_gif_sub_blocks(data, pos + 1)
+        else:
+            raise ValueError(f"unexpected GIF block 0x{block:02x}")
+    return None
+
+
+EXTRACT_REMOVED_TAGS = ('script', 'style', 'noscript', 'nav', 'header', 'footer', 'aside', 'form', 'iframe',
+                        'button', 'svg')
+EXTRACT_POSITIVE_PATTERN = re.compile(r'article|content|post|entry|main|body|text|detail', re.I)
+EXTRACT_NEGATIVE_PATTERN = re.compile(r'comment|footer|sidebar|related|share|recommend|nav|menu|banner|advert', re.I)
+
+
+def text_length(html_content):
+    """Number of characters of text in markup"""
+    return len(unescape(HTML_TAG_PATTERN.sub('', html_content or '')).strip())
+
+
+def extract_article(page, encoding=None):
+    """
+    Pull the main article out of a web page
+    
+    An <article> element with enough text wins. Otherwise paragraphs
+    score their parent (and half for the grandparent) by their text
+    length, weighted by class and id names, and the best container is
+    taken.
+    
+    Args:
+        page: Raw page bytes
+        encoding: Charset from the Content-Type header, detected when None
+        
+    Returns:
+        Inner HTML of the article, or None if no article text was found
+    """
+    bs4 = lazy_import('bs4')
+    soup = bs4.BeautifulSoup(page, HTML_PARSER, from_encoding=encoding)
+    for tag in soup.find_all(EXTRACT_REMOVED_TAGS):
+        if not tag.decomposed:
+            tag.decompose()
+    
+    best, best_length = None, 0
+    for tag in soup.find_all('article'):
+        length = len(tag.get_text(strip=True))
+        if length > best_length:
+            best, best_length = tag, length
+    
+    if best_length < FULL_TEXT_SUMMARY_CHARS:
+        scores = {}
+        for paragraph in soup.find_all(['p', 'pre', 'blockquote']):
+            length = len(paragraph.get_text(strip=True))
+            if length < 20:
+                continue
+            for container, share in ((paragraph.parent, 1.0), (paragraph.parent and paragraph.parent.parent, 0.5)):
+                if container is None or container.name in ('[document]', 'html', 'body'):
+                    continue
+                score, _ = scores.get(id(container), (0.0, container))
+                scores[id(container)] = (score + length * share, container)
+        for score, container in scores.values():
+            names = ' '.join(container.get('class') or []) + ' ' + (container.get('id') or '')
+            if EXTRACT_NEGATIVE_PATTERN.search(names):
+                score *= 0.25
+            elif EXTRACT_POSITIVE_PATTERN.search(names):
+                score *= 1.25
+            if score > best_length:
+                best, best_length = container, score
+    
+    if best is None or len(best.get_text(strip=True)) < FULL_TEXT_SUMMARY_CHARS:
+        return None
+    return best.decode_contents()
+
+
+def get_cached_article(url):
+    """Return (etag, last_modified, fetched, content) of a stored extract, or None"""
+    conn = open_feed_cache()
+    with _feed_cache_lock:
+        row = conn.execute("SELECT etag, last_modified, fetched, content FROM articles WHERE url = ?",
+                           (url,)).fetchone()
+        if row is None:
+            return None
+        conn.execute("UPDATE articles SET last_used = ? WHERE url = ?", (time.time(), url))
+        conn.commit()
+    etag, last_modified, fetched, content = row
+    return etag, last_modified, fetched, zlib.decompress(content).decode('utf-8') if content else None
+
+
+def store_cached_article(url, etag, last_modified, content):
+    """Store an extract (None if the page had no article) with its validators"""
+    conn = open_feed_cache()
+    now = time.time()
+    with _feed_cache_lock:
+        conn.execute("INSERT OR REPLACE INTO articles (url, etag, last_modified, fetched, last_used, content) "
+                     "VALUES (?, ?, ?, ?, ?, ?)",
+                     (url, etag, last_modified, now, now,
+                      zlib.compress(content.encode('utf-8')) if content else None))
+        conn.commit()
+
+
+def fetch_full_article(url):
+    """
+    Fetch an article page and extract its content, using the cache when possible
+    
+    Extracts younger than FULL_TEXT_FRESH are used as they are, older
+    ones are revalidated with the stored ETag / Last-Modified. Pages over
+    FULL_TEXT_MAX_BYTES or taking longer than FULL_TEXT_TIMEOUT are
+    given up.
+    
+    Returns:
+        Article HTML, or None to keep the entry's summary
+    """
+    try:
+        cached = get_cached_article(url)
+    except sqlite3.Error as e:
+        print(f"Could not read cached article {url}: {e}")
+        cached = None
+    if cached and time.time() - cached[2] < FULL_TEXT_FRESH:
+        metrics.count('full_text_cache_hits')
+        return cached[3]
+    
+    headers = {}
+    if cached:
+        if cached[0]:
+            headers['If-None-Match'] = cached[0]
+        if cached[1]:
+            headers['If-Modified-Since'] = cached[1]
+    
+    response = None
+    try:
+        start = time.monotonic()
+        with metrics.timer('full_text_http'):
+            response = guarded_get(url, FULL_TEXT_TIMEOUT, FULL_TEXT_DEADLINE_SHARE, headers=headers, stream=True)
+            if response.status_code == 304 and cached:
+                metrics.count('full_text_cache_hits')
+                store_cached_article(url, cached[0], cached[1], cached[3])
+                return cached[3]
+            if response.status_code != 200:
+                print(f"Could not fetch article: HTTP {response.status_code} for {url}")
+                metrics.error('full_text', f"HTTP {response.status_code} for {url}")
+                return None
+            
+            length = response.headers.get('Content-Length', '')
+            if length.isdigit() and int(length) > FULL_TEXT_MAX_BYTES:
+                print(f"Article page too large ({int(length) // 1024} KB): {url}")
+                metrics.count('full_text_skipped')
+                return None
+            page = bytearray()
+            for chunk in response.iter_content(64 * 1024):
+                page += chunk
+                if len(page) > FULL_TEXT_MAX_BYTES or time.monotonic() - start > FULL_TEXT_TIMEOUT:
+                    print(f"Article page over its size or time budget: {url}")
+                    metrics.count('full_text_skipped')
+                    return None
+            metrics.count('full_text_bytes', len(page))
+        
+        # Only trust a charset the server states, bs4 reads <meta charset> otherwise
+        encoding = response.encoding if 'charset=' in response.headers.get('Content-Type', '').lower() else None
+        with metrics.timer('full_text_extract'):
+            content = extract_article(bytes(page), encoding)
+        if content is None:
+            print(f"No article found on page: {url}")
+            metrics.count('full_text_not_found')
+        store_cached_article(url, response.headers.get('ETag'), response.headers.get('Last-Modified'), content)
+        return content
+    except Exception as e:
+        print(f"Could not fetch article {url}: {e}")
+        metrics.error('full_text', f"{url}: {e}")
+        return cached[3] if cached else None
+    finally:
+        if response is not None:
+            response.close()
+
+
+def fetch_full_articles(feeds, prepared=None):
+    """
+    Replace summaries with the full article for feeds with the full_text option
+    
+    Only entries whose text is shorter than FULL_TEXT_SUMMARY_CHARS are
+    fetched, with at most FULL_TEXT_WORKERS pages at a time and
+    MAX_CONNECTIONS_PER_HOST per host. Entries keep their summary when
+    no article can be extracted.
+    
+    Args:
+        feeds: Feeds whose entries are updated in place
+        prepared: Articles already cleaned, see collect_articles(), they are skipped
+    """
+    entries = [entry for feed in feeds if (feed.options or DEFAULT_FEED_OPTIONS).get('full_text')
+               for entry in feed.entries
+               if entry.link and not (prepared and entry.id in prepared)
+               and text_length(entry.content) < FULL_TEXT_SUMMARY_CHARS]
+    if not entries:
+        return
+    
+    print(f"Fetching full text of {len(entries)} articles...")
+    start = time.perf_counter()
+    host_slot = host_limiter(MAX_CONNECTIONS_PER_HOST)
+    
+    def fetch(entry):
+        with host_slot(entry.link):
+            return fetch_full_article(entry.link)
+    
+    extracted = 0
+    with ThreadPoolExecutor(max_workers=max(1, min(FULL_TEXT_WORKERS, len(entries)))) as pool:
+        futures = {pool.submit(fetch, entry): entry for entry in entries}
+        for future in as_completed(futures):
+            content = future.result()
+            if content:
+                futures[future].content = content
+                extracted += 1
+    metrics.count('full_text_articles', extracted)
+    save_feed_cache()
+    print(f"Extracted {extracted}/{len(entries)} full articles in {time.perf_counter() - start:.2f}s")
+
+
+def download_image(img_url, budget=None, feed_budget=None):
+    """
+    Stream a single image, return its raw bytes or None
+    
+    The first bytes are probed for format and dimensions, so tracking
+    pixels and oversized images are dropped before the rest is read.
+    Downloads stop at IMAGE_MAX_BYTES, when the run's budget is spent,
+    after IMAGE_TIMEOUT seconds or at the image deadline, even while
+    bytes keep trickling in. GIFs are only read up to the end of their
+    first frame.
+    
+    Args:
+        img_url: Image URL
+        budget: ImageByteBudget shared by the downloads of this run, or None
+        feed_budget: ImageByteBudget of the feed's max_bytes, see image_download_budgets()
+    """
+    response = None
+    try:
+        print(f"Downloading image: {img_url}")
+        start = time.monotonic()
+        with metrics.timer('image_http'):
+            response = guarded_get(img_url, IMAGE_TIMEOUT, IMAGE_DEADLINE_SHARE, stream=True)
+            if response.status_code != 200:
+                print(f"Failed to download image: HTTP {response.status_code} for {img_url}")
+                metrics.error('image', f"HTTP {response.status_code} for {img_url}")
+                return None
+            
+            length = response.headers.get('Content-Length', '')
+            if length.isdigit() and int(length) > IMAGE_MAX_BYTES:
+                print(f"Skipping image of {int(length) // 1024} KB: {img_url}")
+                metrics.count('images_dropped_oversized')
+                remember_dropped_image(img_url)
+                return None
+            
+            data = bytearray()
+            probe_at = IMAGE_PROBE_BYTES
+            probe = None
+            gif = None
+            for chunk in response.iter_content(IMAGE_PROBE_BYTES):
+                # Read timeouts only bound each chunk, a slow stream is cut off here
+                left = time_left(IMAGE_DEADLINE_SHARE)
+                if time.monotonic() - start > IMAGE_TIMEOUT or (left is not None and left <= 0):
+                    print(f"Image download too slow, skipping {img_url}")
+                    metrics.count('images_skipped_deadline')
+                    return None
+                if feed_budget is not None and not feed_budget.take(len(chunk)):
+                    # Raw bytes are an upper bound of the processed size apply_image_budgets() counts
+                    print(f"Image budget of the feed spent, skipping {img_url}")
+                    metrics.count('images_dropped_feed_budget')
+                    return None
+                if budget is not None and not budget.take(len(chunk)):
+                    print(f"Image download budget spent, skipping {img_url}")
+                    metrics.count('images_dropped_budget')
+                    return None
+                data += chunk
+                metrics.count('image_bytes_downloaded', len(chunk))
+                if len(data) > IMAGE_MAX_BYTES:
+                    print(f"Skipping image larger than {IMAGE_MAX_BYTES // 1024} KB: {img_url}")
+                    metrics.count('images_dropped_oversized')
+                    remember_dropped_image(img_url)
+                    return None
+                
+                if probe is None and len(data) >= probe_at:
+                    # Headers with large metadata blocks need a few more bytes
+                    probe = probe_image(data)
+                    probe_at = probe_at * 2 if probe_at < 4 * IMAGE_PROBE_BYTES else IMAGE_MAX_BYTES + 1
+                    reason = probe and image_drop_reason(probe)
+                    if reason:
+                        print(f"Skipping {reason} image {probe[1]}x{probe[2]}: {img_url}")
+                        metrics.count(f'images_dropped_{reason}')
+                        remember_dropped_image(img_url)
+                        return None
+                
+                if gif is None:
+                    gif = data[:3] == b'GIF'
+                if gif:
+                    try:
+                        end = gif_first_frame_end(data)
+                    except ValueError:
+                        gif = False
+                        continue
+                    if end is not None:
+                        if data[end:end + 1] != b';':
+                            metrics.count('images_first_frame_only')
+                        # Keep the first frame and close the stream with a trailer
+                        del data[end:]
+                        data += b';'
+                        break
+        
+        if probe is None:
+            # Smaller than the probe size, check the complete image
+            probe = probe_image(data)
+            reason = probe and image_drop_reason(probe)
+            if reason:
+                print(f"Skipping {reason} image {probe[1]}x{probe[2]}: {img_url}")
+                metrics.count(f'images_dropped_{reason}')
+                remember_dropped_image(img_url)
+                return None
+        metrics.count('images_downloaded')
+        return bytes(data)
+    except Exception as e:
+        print(f"Failed to download image: {e}")
+        metrics.error('image', f"{img_url}: {e}")
+    finally:
+        if response is not None:
+            response.close()
+    return None
+
+
+def target_image_size(width, height, mode=None, max_size=None):
+    """
+    Calculate the size an image is resized to
+    
+    Args:
+        width: Original width in pixels
+        height: Original height in pixels
+        mode: "screen" to fit inside max_size without upscaling,
+            "scale" for the legacy 30% of the original size
+        max_size: (width, height) bounds for "screen" mode
+        
+    Returns:
+        (width, height) tuple, equal to the original size when no resize is needed
+    """
+    mode = mode or IMAGE_RESIZE_MODE
+    if mode == "scale":
+        return max(1, int(width * 0.3)), max(1, int(height * 0.3))
+    
+    max_width, max_height = max_size or IMAGE_MAX_SIZE
+    scale = min(max_width / width, max_height / height, 1.0)
+    if scale >= 1.0:
+        return width, height
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _flatten_to_white(image):
+    """Composite transparent images onto a white background"""
+    if image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info):
+        image = image.convert('RGBA')
+        background = lazy_import('PIL.Image').new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        return background
+    return image
+
+
+def _eink_palette():
+    """Palette image with EINK_GRAY_LEVELS evenly spaced grays"""
+    step = 255 / (EINK_GRAY_LEVELS - 1)
+    levels = [round(i * step) for i in range(EINK_GRAY_LEVELS)]
+    palette = []
+    for level in levels:
+        palette.extend((level, level, level))
+    palette_image = lazy_import('PIL.Image').new('P', (1, 1))
+    palette_image.putpalette(palette + [0, 0, 0] * (256 - EINK_GRAY_LEVELS))
+    return palette_image
+
+
+def encode_grayscale(image, encoding, original=None):
+    """
+    Encode an image for grayscale e-ink panels
+    
+    The image is converted to 8-bit gray ("grayscale") or dithered to
+    EINK_GRAY_LEVELS grays ("eink"), then encoded as both a baseline JPEG
+    and a PNG; the smaller result is kept.
+    
+    Args:
+        image: Resized PIL image
+        encoding: "grayscale" or "eink"
+        original: (bytes, extension, media_type) of an untouched gray
+            download that may be stored as is, compared like the other candidates
+            
+    Returns:
+        (image_bytes, extension, media_type) tuple
+    """
+    Image = lazy_import('PIL.Image')
+    gray = _flatten_to_white(image).convert('L')
+    candidates = []
+    if original:
+        candidates.append(original)
+    
+    # Baseline (non-progressive) JPEG of the smooth grayscale image suits photos
+    jpeg_bytes = io.BytesIO()
+    gray.save(jpeg_bytes, format='JPEG', quality=80, progressive=False)
+    candidates.append((jpeg_bytes.getvalue(), 'jpg', 'image/jpeg'))
+    
+    png_bytes = io.BytesIO()
+    if encoding == "eink":
+        # Floyd-Steinberg dithering to the panel's gray levels suits line art and text
+        quantized = gray.convert('RGB').quantize(palette=_eink_palette(), dither=Image.Dither.FLOYDSTEINBERG)
+        quantized.save(png_bytes, format='PNG', bits=4)
+    else:
+        gray.save(png_bytes, format='PNG')
+    candidates.append((png_bytes.getvalue(), 'png', 'image/png'))
+    
+    return min(candidates, key=lambda candidate: len(candidate[0]))
+
+
+def process_image(content, mode=None, max_size=None, encoding=None):
+    """
+    Resize an image for the e-reader screen and re-encode it
+    
+    JPEGs are decoded at a reduced size with Pillow's draft mode, and
+    JPEG/PNG/GIF images that already fit are kept as they are in color
+    mode. Grayscale encodings are handled by encode_grayscale().
+    
+    Args:
+        content: Raw image bytes
+        mode: Resize mode, see target_image_size()
+        max_size: (width, height) bounds for "screen" mode
+        encoding: "color", "grayscale" or "eink" (defaults to IMAGE_ENCODING)
+        
+    Returns:
+        (image_bytes, extension, media_type) tuple
+    """
+    encoding = encoding or IMAGE_ENCODING
+    Image = lazy_import('PIL.Image')
+    try:
+        # Load image from response content (only the header is read here)
+        original_image = Image.open(io.BytesIO(content))
+        original_format = original_image.format
+        # draft() below may switch a color JPEG to gray, so the source mode is kept
+        source_mode = original_image.mode
+        
+        # Get original size
+        original_width, original_height = original_image.size
+        print(f"Original image size: {original_width}x{original_height}")
+        
+        new_width, new_height = target_image_size(original_width, original_height, mode, max_size)
+        original = None
+        animated = getattr(original_image, 'is_animated', False)
+        if animated:
+            # Only the first frame is shown, the frames after it are not stored
+            print("Animated image, keeping the first frame")
+        if ((new_width, new_height) == (original_width, original_height)
+                and original_format in KEEP_AS_IS_FORMATS and not animated):
+            extension, media_type = KEEP_AS_IS_FORMATS[original_format]
+            original = (content, extension, media_type)
+            if encoding == "color":
+                # Small enough already, skip decoding and re-encoding
+                print(f"Image fits the screen, keeping original {original_format}")
+                return original
+        
+        if original_format == 'JPEG':
+            # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding
+            original_image.draft('L' if encoding != "color" else original_image.mode, (new_width, new_height))
+        
+        # Resize image
+        resized_image = original_image
+        if resized_image.size != (new_width, new_height):
+            resized_image = resized_image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+        print(f"Resized image to: {new_width}x{new_height}")
+        
+        if encoding != "color":
+            # An untouched download only competes when it is already gray
+            keep_original = original if source_mode in ('1', 'L') else None
+            return encode_grayscale(resized_image, encoding, keep_original)
+        
+        # Save resized image to bytes
+        img_bytes = io.BytesIO()
+        
+        # Determine format and save
+        if original_format in ['JPEG', 'JPG']:
+            # Convert RGBA to RGB if necessary for JPEG
+            if resized_image.mode == 'RGBA':
+                rgb_image = Image.new('RGB', resized_image.size, (255, 255, 255))
+                rgb_image.paste(resized_image, mask=resized_image.split()[-1])
+                resized_image = rgb_image
+            resized_image.save(img_bytes, format='JPEG', quality=85, optimize=True)
+            return img_bytes.getvalue(), 'jpg', 'image/jpeg'
+        
+        # Save as PNG for other formats
+        resized_image.save(img_bytes, format='PNG', optimize=True)
+        return img_bytes.getvalue(), 'png', 'image/png'
+        
+    except Exception as resize_error:
+        print(f"Failed to resize image, using original: {resize_error}")
+        # Fallback to original image if resize fails
+        return content, 'jpg', 'image/jpeg'
+
+
+def image_settings():
+    """Current image processing settings, as (resize mode, max size, encoding)"""
+    return IMAGE_RESIZE_MODE, IMAGE_MAX_SIZE, IMAGE_ENCODING
+
+
+def image_profile(settings=None):
+    """Name of image processing settings (the current ones by default), part of every image cache key"""
+    mode, max_size, encoding = settings or image_settings()
+    if mode == "scale":
+        profile = "scale30"
+    else:
+        profile = f"screen{max_size[0]}x{max_size[1]}"
+    if encoding != "color":
+        profile += f"-{encoding}"
+    return profile
+
+
+def _image_url_key(url, profile=None):
+    """Cache key of an image URL under a processing profile, the current one by default"""
+    return hashlib.sha1(f"{profile or image_profile()}\n{url}".encode('utf-8')).hexdigest()
+
+
+def _image_source_key(content, profile=None):
+    """Cache key of raw image bytes under a processing profile, the current one by default"""
+    return hashlib.sha1((profile or image_profile()).encode('utf-8') + b"\n" + content).hexdigest()
+
+
+def _dropped_image_key(url):
+    """Key of an image URL left out for its size, the same under every processing profile"""
+    return hashlib.sha1(url.encode('utf-8')).hexdigest()
+
+
+def _image_cache_file(content_hash, extension):
+    """Path of a processed image in the cache"""
+    return os.path.join(IMAGE_CACHE_DIR, f"{content_hash}.{extension}")
+
+
+def load_image_cache_index():
+    """Load the image cache index from disk (once per run)"""
+    global _image_cache_index
+    with _image_cache_lock:
+        if _image_cache_index is None:
+            try:
+                with open(os.path.join(IMAGE_CACHE_DIR, "index.json"), 'r') as f:
+                    _image_cache_index = json.load(f)
+            except (OSError, ValueError):
+                _image_cache_index = {}
+            for section in ('urls', 'sources', 'blobs', 'dropped'):
+                _image_cache_index.setdefault(section, {})
+        return _image_cache_index
+
+
+def save_image_cache_index(max_bytes=IMAGE_CACHE_MAX_BYTES):
+    """Evict least recently used images beyond the byte budget and write the index to disk"""
+    with _image_cache_lock:
+        index = _image_cache_index
+        if index is None:
+            return
+        try:
+            os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+            
+            blobs = index['blobs']
+            total = sum(blob['size'] for blob in blobs.values())
+            evicted = set()
+            for content_hash, blob in sorted(blobs.items(), key=lambda kv: kv[1]['last_used']):
+                if total <= max_bytes:
+                    break
+                if content_hash in _image_cache_in_use:
+                    # Still to be copied into this run's EPUBs, the cache may stay over budget until the next run
+                    continue
+                total -= blob['size']
+                evicted.add(content_hash)
+                try:
+                    os.remove(_image_cache_file(content_hash, blob['extension']))
+                except OSError:
+                    pass
+            
+            cutoff = time.time() - DROPPED_IMAGE_EXPIRE_DAYS * 86400
+            index['dropped'] = {key: dropped for key, dropped in index['dropped'].items() if dropped >= cutoff}
+            
+            if evicted:
+                print(f"Evicted {len(evicted)} images from cache ({total} bytes kept)")
+                for content_hash in evicted:
+                    del blobs[content_hash]
+                for section in ('urls', 'sources'):
+                    index[section] = {key: value for key, value in index[section].items() if value not in evicted}
+            
+            index_path = os.path.join(IMAGE_CACHE_DIR, "index.json")
+            with open(index_path + ".tmp", 'w') as f:
+                json.dump(index, f)
+            os.replace(index_path + ".tmp", index_path)
+        except OSError as e:
+            print(f"Could not save image cache: {e}")
+
+
+def _lookup_cached_image(section, key):
+    """Return (content_hash, extension, media_type) for a cache key, or None"""
+    index = load_image_cache_index()
+    with _image_cache_lock:
+        content_hash = index[section].get(key)
+        blob = index['blobs'].get(content_hash) if content_hash else None
+        if blob is None:
+            return None
+        if not os.path.exists(_image_cache_file(content_hash, blob['extension'])):
+            del index['blobs'][content_hash]
+            return None
+        blob['last_used'] = time.time()
+        _image_cache_in_use.add(content_hash)
+        return content_hash, blob['extension'], blob['media_type']
+
+
+def remember_dropped_image(url):
+    """Record an image left out for its size, so later runs do not request it again"""
+    index = load_image_cache_index()
+    with _image_cache_lock:
+        index['dropped'][_dropped_image_key(url)] = time.time()
+
+
+def store_cached_image(url, source_key, result, profile=None):
+    """
+    Store a processed image in the cache
+    
+    Args:
+        url: URL the image was downloaded from
+        source_key: Key of the raw downloaded bytes
+        result: (image_bytes, extension, media_type) from process_image()
+        profile: Name of the processing profile, the current one by default
+        
+    Returns:
+        (content_hash, extension, media_type) tuple
+    """
+    content, extension, media_type = result
+    content_hash = hashlib.sha1(content).hexdigest()
+    cache_file = _image_cache_file(content_hash, extension)
+    if not os.path.exists(cache_file):
+        os.makedirs(IMAGE_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_file}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(content)
+        os.replace(tmp_path, cache_file)
+    
+    index = load_image_cache_index()
+    with _image_cache_lock:
+        index['blobs'][content_hash] = {
+            'extension': extension,
+            'media_type': media_type,
+            'size': len(content),
+            'last_used': time.time(),
+        }
+        index['urls'][_image_url_key(url, profile)] = content_hash
+        index['sources'][source_key] = content_hash
+        _image_cache_in_use.add(content_hash)
+    return content_hash, extension, media_type
+
+
+def image_download_budgets(feed_articles, image_budgets):
+    """
+    Download budgets of the images of feeds with max_bytes, by image URL
+    
+    Each such feed gets one ImageByteBudget holding the bytes its text
+    leaves for images. An image also used by a feed without a limit is
+    not budgeted.
+    
+    Args:
+        feed_articles: (feed_title, articles) tuples from collect_articles()
+        image_budgets: Bytes left for the images of each feed, from collect_articles()
+    """
+    budgets = {}
+    unlimited = set()
+    for (_, articles), limit in zip(feed_articles, image_budgets):
+        budget = ImageByteBudget(limit) if limit is not None else None
+        for article in articles:
+            for img_url, _, _ in article['images']:
+                if budget is None:
+                    unlimited.add(img_url)
+                else:
+                    budgets.setdefault(img_url, budget)
+    return {img_url: budget for img_url, budget in budgets.items() if img_url not in unlimited}
+
+
+def prepare_images(urls, settings_list, max_downloads=MAX_IMAGE_DOWNLOADS,
+                   max_per_host=MAX_CONNECTIONS_PER_HOST, max_workers=IMAGE_PROCESS_WORKERS, feed_budgets=None):
+    """
+    Download images once and resize them for each set of image settings in a worker pool
+    
+    Images already in the on-disk cache, by URL or by the hash of the
+    downloaded bytes, are not resized again. An image is downloaded if
+    any of the settings still needs it.
+    
+    Args:
+        urls: Image URLs, duplicates are fetched once
+        settings_list: (resize mode, max size, encoding) tuples, see image_settings()
+        max_downloads: Maximum number of images downloaded at the same time
+        max_per_host: Maximum number of concurrent downloads from one host
+        max_workers: Number of threads decoding and resizing images
+        feed_budgets: ImageByteBudget by image URL for feeds with max_bytes, see image_download_budgets()
+        
+    Returns:
+        List with one dict per settings mapping image URL to cached
+        (content_hash, extension, media_type), failed downloads are left out
+    """
+    profiles = [image_profile(settings) for settings in settings_list]
+    results = [{} for _ in settings_list]
+    unique_urls = list(dict.fromkeys(urls))
+    if not unique_urls:
+        return results
+    
+    hits = 0
+    for profile, profile_results in zip(profiles, results):
+        for url in unique_urls:
+            cached = _lookup_cached_image('urls', _image_url_key(url, profile))
+            if cached:
+                profile_results[url] = cached
+                hits += 1
+    dropped = load_image_cache_index()['dropped']
+    needed = [url for url in unique_urls if any(url not in profile_results for profile_results in results)]
+    missing = [url for url in needed if _dropped_image_key(url) not in dropped]
+    print(f"{hits} images found in cache, {len(missing)} to download")
+    metrics.count('image_cache_hits', hits)
+    metrics.count('images_dropped_before', len(needed) - len(missing))
+    
+    host_slot = host_limiter(max_per_host)
+    budget = ImageByteBudget(IMAGE_RUN_MAX_BYTES or None)
+    
+    feed_budgets = feed_budgets or {}
+    
+    def fetch(url):
+        with host_slot(url):
+            return download_image(url, budget, feed_budgets.get(url))
+    
+    savings = {'images': 0, 'input_bytes': 0, 'output_bytes': 0}
+    savings_lock = threading.Lock()
+    
+    def process(url, content, index):
+        profile = profiles[index]
+        source_key = _image_source_key(content, profile)
+        cached = _lookup_cached_image('sources', source_key)
+        if cached:
+            # Same bytes behind a different URL
+            with _image_cache_lock:
+                _image_cache_index['urls'][_image_url_key(url, profile)] = cached[0]
+            metrics.count('image_cache_hits')
+            return cached
+        mode, max_size, encoding = settings_list[index]
+        with metrics.timer('image_process'):
+            result = process_image(content, mode, max_size, encoding)
+        metrics.count('images_processed')
+        metrics.count('image_bytes_stored', len(result[0]))
+        with savings_lock:
+            savings['images'] += 1
+            savings['input_bytes'] += len(content)
+            savings['output_bytes'] += len(result[0])
+        return store_cached_image(url, source_key, result, profile)
+    
+    start = time.perf_counter()
+    if missing:
+        print(f"Downloading {len(missing)} images with up to {max_downloads} connections...")
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as process_pool:
+            pending = {}
+            with ThreadPoolExecutor(max_workers=max(1, min(max_downloads, len(missing)))) as download_pool:
+                downloads = {download_pool.submit(fetch, url): url for url in missing}
+                # Hand each image to the process pool as soon as it arrives, once per settings lacking it
+                for future in as_completed(downloads):
+                    content = future.result()
+                    left = time_left(IMAGE_DEADLINE_SHARE)
+                    if content and left is not None and left <= 0:
+                        # Out of time, leave the remaining images out
+                        metrics.count('images_skipped_deadline')
+                        continue
+                    if content:
+                        url = downloads[future]
+                        for index, profile_results in enumerate(results):
+                            if url not in profile_results:
+                                pending[process_pool.submit(process, url, content, index)] = (url, index)
+            
+            for future in as_completed(pending):
+                url, index = pending[future]
+                try:
+                    results[index][url] = future.result()
+                except Exception as e:
+                    print(f"Failed to cache image {url}: {e}")
+                    metrics.error('image', f"{url}: {e}")
+    
+    save_image_cache_index()
+    elapsed = time.perf_counter() - start
+    for profile, profile_results in zip(profiles, results):
+        print(f"Prepared {len(profile_results)}/{len(unique_urls)} images ({profile}) in {elapsed:.2f}s")
+    if savings['images']:
+        saved = savings['input_bytes'] - savings['output_bytes']
+        print(f"Image encoding ({', '.join(profiles)}): {savings['images']} images, "
+              f"{savings['input_bytes'] // 1024} KB downloaded, {savings['output_bytes'] // 1024} KB stored, "
+              f"saved {saved // 1024} KB ({100 * saved / savings['input_bytes']:.0f}%)")
+    return results
+
+
+def attach_images(html, images, processed, book, added_images):
+    """
+    Add processed images to the book and put them in place of their placeholders
+    
+    Identical images share a single book item named after their content hash.
+    Images that could not be downloaded keep their original markup.
+    
+    Args:
+        html: Cleaned article HTML from clean_html()
+        images: (image_url, alt_text, original_markup) tuples from clean_html()
+        processed: Results of prepare_images() for one profile
+        book: EpubWriter receiving the image files
+        added_images: Set of content hashes already added to the book
+        
+    Returns:
+        Article HTML with image markup
+    """
+    def replace(match):
+        img_url, alt, original_markup = images[int(match.group(1))]
+        if img_url not in processed:
+            return original_markup
+        content_hash, extension, media_type = processed[img_url]
+        img_filename = f"{content_hash}.{extension}"
+        
+        if content_hash not in added_images:
+            try:
+                # Streamed from the image cache straight into the book
+                book.add_file_from_path(f'images/{img_filename}', media_type,
+                                        _image_cache_file(content_hash, extension))
+            except OSError as e:
+                print(f"Cached image missing for {img_url}: {e}")
+                return original_markup
+            added_images.add(content_hash)
+        
+        # 强制居中：包装图片在div容器中
+        return f'<div class="image-container"><img src="images/{img_filename}" alt="{escape(alt)}"/></div>'
+    
+    return IMAGE_PLACEHOLDER_PATTERN.sub(replace, html)
+
+
+def article_id(entry):
+    """
+    Stable identifier of an article: GUID, then link, then a hash of title and content
+    
+    Returns:
+        40 character hex digest
+    """
+    key = entry.get('id') or entry.get('link')
+    if not key:
+        key = f"{entry.get('title', '')}\n{entry_content(entry)}"
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def open_seen_index(path=None):
+    """Open the seen-article index, creating it if needed"""
+    path = path or SEEN_INDEX_PATH
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE IF NOT EXISTS seen (id TEXT PRIMARY KEY, first_seen REAL NOT NULL)")
+    return conn
+
+
+def expire_seen_entries(conn, days=SEEN_EXPIRE_DAYS):
+    """Forget articles first delivered more than `days` days ago"""
+    cutoff = time.time() - days * 86400
+    removed = conn.execute("DELETE FROM seen WHERE first_seen < ?", (cutoff,)).rowcount
+    conn.commit()
+    if removed:
+        print(f"Expired {removed} old records from the seen-article index")
+
+
+def filter_seen_entries(feeds, conn):
+    """
+    Drop articles delivered on an earlier day from the feeds
+    
+    Articles first delivered today are kept, so running again on the
+    same day rebuilds today's EPUB with everything new since yesterday.
+    
+    Returns:
+        Number of articles skipped
+    """
+    today = datetime.datetime.combine(datetime.date.today(), datetime.time()).timestamp()
+    skipped = 0
+    for feed in feeds:
+        kept = []
+        for entry in feed.entries:
+            row = conn.execute("SELECT first_seen FROM seen WHERE id = ?", (entry.id,)).fetchone()
+            if row and row[0] < today:
+                skipped += 1
+            else:
+                kept.append(entry)
+        feed.entries = kept
+    return skipped
+
+
+def mark_entries_seen(feeds, conn, duplicates=(), delivered=None):
+    """
+    Record the articles of a written EPUB, and the duplicates dropped from it, in the seen-article index
+    
+    Args:
+        delivered: Ids of the articles actually written, None for every entry of the feeds
+    """
+    now = time.time()
+    entries = [entry for feed in feeds for entry in feed.entries
+               if delivered is None or entry.id in delivered] + list(duplicates)
+    conn.executemany("INSERT OR IGNORE INTO seen (id, first_seen) VALUES (?, ?)",
+                     [(entry.id, now) for entry in entries])
+    conn.commit()
+
+
+def normalize_link(link):
+    """
+    Canonical form of an article link for comparing copies across feeds
+    
+    Scheme, "www." / "m." host prefixes, fragments, trailing slashes and
+    tracking parameters are ignored.
+    """
+    parsed = urlparse(link.strip())
+    if not parsed.netloc:
+        return None
+    host = parsed.netloc.lower()
+    for prefix in ('www.', 'm.'):
+        if host.startswith(prefix):
+            host = host[len(prefix):]
+    query = urlencode(sorted((key, value) for key, value in parse_qsl(parsed.query, keep_blank_values=True)
+                             if not TRACKING_PARAMS.match(key)))
+    return f"{host}{parsed.path.rstrip('/')}?{query}"
+
+
+HTML_TAG_PATTERN = re.compile(r'<[^>]*>')
+# CJK characters are tokens of their own, other text is split into words
+TEXT_TOKEN_PATTERN = re.compile(r'[\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]|[^\W\u3040-\u30ff\u3400-\u9fff\uac00-\ud7af]+')
+
+
+def simhash(html_content):
+    """
+    64-bit simhash of the text of an article, over shingles of three tokens
+    
+    Copies of an article with small differences (another site's footer,
+    a changed headline) get hashes that differ in only a few bits.
+    
+    Returns:
+        Fingerprint as int, or None if the text is too short to compare
+    """
+    text = unescape(HTML_TAG_PATTERN.sub(' ', html_content)).lower()
+    tokens = TEXT_TOKEN_PATTERN.findall(text)[:SIMHASH_MAX_TOKENS]
+    if len(tokens) < SIMHASH_MIN_TOKENS:
+        return None
+    shingles = {' '.join(tokens[i:i + 3]) for i in range(len(tokens) - 2)}
+    bits = [format(int.from_bytes(hashlib.blake2b(shingle.encode('utf-8'), digest_size=8).digest(), 'big'), '064b')
+            for shingle in shingles]
+    # A bit is set when it is set in the hashes of most shingles
+    half = len(bits) / 2
+    fingerprint = 0
+    for column in zip(*bits):
+        fingerprint = (fingerprint << 1) | (column.count('1') > half)
+    return fingerprint
+
+
+def drop_duplicate_entries(feeds):
+    """
+    Drop articles that already appeared in an earlier feed or earlier in the same feed
+    
+    Copies are recognized by GUID, by normalized link, or by a simhash of
+    their text within DUPLICATE_MAX_DISTANCE bits. A shared link is not
+    enough within one feed, where the GUIDs tell the articles apart, nor
+    when both texts have a fingerprint and they disagree (feeds linking
+    every item to their homepage). The first copy, in config order, is
+    kept, so duplicates never reach image processing.
+    
+    Returns:
+        List of the dropped entries
+    """
+    def close(fingerprint, other):
+        return bin(fingerprint ^ other).count('1') <= DUPLICATE_MAX_DISTANCE
+    
+    seen_ids = set()
+    seen_links = {}  # Normalized link to (feed index, fingerprint) of the kept entries
+    fingerprints = []
+    dropped = []
+    for feed_index, feed in enumerate(feeds):
+        kept = []
+        for entry in feed.entries:
+            link = normalize_link(entry.link) if entry.link else None
+            fingerprint = simhash(entry.content)
+            duplicate = entry.id in seen_ids or any(
+                other_feed != feed_index and (fingerprint is None or other is None or close(fingerprint, other))
+                for other_feed, other in seen_links.get(link, ()))
+            if not duplicate and fingerprint is not None:
+                duplicate = any(close(fingerprint, other) for other in fingerprints)
+            if duplicate:
+                dropped.append(entry)
+                continue
+            kept.append(entry)
+            seen_ids.add(entry.id)
+            if link:
+                seen_links.setdefault(link, []).append((feed_index, fingerprint))
+            if fingerprint is not None:
+                fingerprints.append(fingerprint)
+        if len(kept) < len(feed.entries):
+            print(f"Dropped {len(feed.entries) - len(kept)} duplicate articles from {feed.title or feed.url}")
+        feed.entries = kept
+    return dropped
+
+
+def generate_identicon(width=SCREEN_WIDTH, height=SCREEN_HEIGHT, block_size=140, background_color=(255, 255, 255), colors=None, seed=None):
+    """
+    Generate a random identicon similar to GitHub default avatars, with fixed resolution for Kobo
+    
+    The pattern is built as one palette index per grid cell and scaled up
+    with nearest-neighbour resampling, so no shapes are drawn and the
+    result is a two-color palette image that encodes to a tiny PNG.
+    
+    Args:
+        width: Image width in pixels (1264 for Kobo)
+        height: Image height in pixels (1680 for Kobo)
+        block_size: Size of each block in the grid
+        background_color: Background color as RGB tuple
+        colors: List of colors to use for blocks, if None random colors will be used
+        seed: Seed for the pattern and color, None for a different cover every time
+        
+    Returns:
+        PIL Image object (mode "P") with the generated identicon
+    """
+    print("Generating random identicon cover image...")
+    rng = random.Random(seed)
+    Image = lazy_import('PIL.Image')
+    
+    # Calculate grid dimensions
+    grid_width = width // block_size
+    grid_height = height // block_size
+    
+    # Make grid width odd for symmetry
+    if grid_width % 2 == 0:
+        grid_width -= 1
+    
+    # Generate random colors if not provided
+    if colors is None:
+        # Generate a random highlight color (more vibrant)
+        hue = rng.randint(0, 360)
+        saturation = rng.randint(70, 100)
+        value = rng.randint(50, 90)
+        
+        # Convert HSV to RGB
+        h_float = hue / 360.0
+        s_float = saturation / 100.0
+        v_float = value / 100.0
+        
+        if h_float == 0:
+            r, g, b = v_float, v_float, v_float
+        else:
+            i = int(h_float * 6.0)
+            f = (h_float * 6.0) - i
+            p = v_float * (1.0 - s_float)
+            q = v_float * (1.0 - s_float * f)
+            t = v_float * (1.0 - s_float * (1.0 - f))
+            i = i % 6
+            
+            if i == 0: r, g, b = v_float, t, p
+            elif i == 1: r, g, b = q, v_float, p
+            elif i == 2: r, g, b = p, v_float, t
+            elif i == 3: r, g, b = p, q, v_float
+            elif i == 4: r, g, b = t, p, v_float
+            elif i == 5: r, g, b = v_float, p, q
+        
+        color = (int(r * 255), int(g * 255), int(b * 255))
+    else:
+        color = rng.choice(colors)
+    
+    print(f"Using color: RGB{color} for identicon")
+    
+    # One byte per grid cell: palette index 1 is a block, 0 the background.
+    # Half of each row is random, the other half mirrors it (horizontal symmetry)
+    half_grid_width = grid_width // 2 + 1
+    cells = bytearray()
+    for i in range(grid_height):
+        # More filled blocks than empty (70% chance of a block)
+        half = [1 if rng.random() < 0.7 else 0 for j in range(half_grid_width)]
+        cells.extend(half + half[grid_width - half_grid_width - 1::-1])
+    
+    grid = Image.frombytes('P', (grid_width, grid_height), bytes(cells))
+    grid.putpalette(list(background_color) + list(color))
+    
+    # Nearest-neighbour upscale keeps hard block edges, then pad to the screen
+    # size; crop() fills the area outside the grid with index 0 (background)
+    img = grid.resize((grid_width * block_size, grid_height * block_size), Image.Resampling.NEAREST)
+    img = img.crop((0, 0, width, height))
+    
+    print("Random identicon generated")
+    return img
+
+
+def cover_seed(article_ids):
+    """
+    Seed for the cover pattern, following COVER_SEED
+    
+    Args:
+        article_ids: article_id() of every article in the book
+        
+    Returns:
+        None for a random cover, otherwise a string that stays the same
+        for the same day ("date") or the same articles ("content")
+    """
+    if COVER_SEED == "date":
+        return datetime.date.today().isoformat()
+    if COVER_SEED == "content":
+        digest = hashlib.sha1()
+        for identifier in article_ids:
+            digest.update(identifier.encode('ascii'))
+        return digest.hexdigest()
+    return None
+
+
+def cover_png(seed=None, width=SCREEN_WIDTH, height=SCREEN_HEIGHT, block_size=140):
+    """
+    PNG bytes of the identicon cover
+    
+    Covers with a seed are cached on disk and reused, since the same
+    seed always gives the same picture. Only the newest
+    COVER_CACHE_MAX_ENTRIES covers are kept.
+    """
+    cache_path = None
+    if seed is not None:
+        key = hashlib.sha1(f"{seed}-{width}x{height}-{block_size}".encode('utf-8')).hexdigest()
+        cache_path = os.path.join(COVER_CACHE_DIR, f"{key}.png")
+        try:
+            with open(cache_path, 'rb') as f:
+                data = f.read()
+            os.utime(cache_path)
+            print(f"Reusing cached cover: {cache_path}")
+            metrics.count('cover_cache_hits')
+            return data
+        except OSError:
+            pass
+    
+    identicon = generate_identicon(width=width, height=height, block_size=block_size, seed=seed)
+    img_bytes = io.BytesIO()
+    # A two-color palette PNG is stored with 1 bit per pixel
+    identicon.save(img_bytes, format='PNG', optimize=True)
+    data = img_bytes.getvalue()
+    
+    if cache_path:
+        try:
+            os.makedirs(COVER_CACHE_DIR, exist_ok=True)
+            with open(cache_path + ".tmp", 'wb') as f:
+                f.write(data)
+            os.replace(cache_path + ".tmp", cache_path)
+            covers = sorted(pathlib.Path(COVER_CACHE_DIR).glob('*.png'), key=lambda path: path.stat().st_mtime)
+            for old_cover in covers[:-COVER_CACHE_MAX_ENTRIES]:
+                old_cover.unlink()
+        except OSError as e:
+            print(f"Could not cache cover: {e}")
+    return data
+
+# Add CSS style
+EPUB_STYLE = '''
+body { 
+    font-family: sans-serif; 
+    font-size: 0.9em;  
+    line-height: 1.4; 
+}
+h1 { 
+    text-align: center; 
+    font-size: 1.1em;  
+    margin: 0.8em 0;   
+}
+h2 { 
+    text-align: center; 
+    font-size: 0.9em;  
+    margin: 0.8em 0;   
+    color: #555; 
+}
+h3 { 
+    font-size: 0.8em;  
+    margin: 0.6em 0; 
+}
+p { 
+    font-size: 0.85em; 
+    margin: 0.5em 0; 
+}
+img { 
+    max-width: 100%; 
+    height: auto; 
+}
+.cover-image { 
+    display: block; 
+    margin: 0 auto; 
+    max-width: 100%; 
+}
+a {
+    font-size: 0.8em;  
+}
+.image-container {
+    text-align: center;
+    margin: 1em 0;
+}
+.image-container img {
+    display: block;
+    margin: 0 auto;
+}
+.page-break {
+    page-break-before: always;
+}
+'''
+
+
+def xhtml_page(title, body, language=None):
+    r"""
+    Wrap body markup in an XHTML document using the default stylesheet, in LANGUAGE by default
+    
+    Only ASCII whitespace is minified, ideographic indents and no-break
+    spaces are part of the text (python -m doctest rss.py):
+    
+    >>> page = xhtml_page('T', '<p>\u3000\u3000人民网 记者\xa0\xa0\xa0张三 </p>\n<p>x</p>')
+    >>> page[page.index('<body>'):]
+    '<body><p>\u3000\u3000人民网 记者\xa0\xa0\xa0张三</p><p>x</p></body></html>'
+    """
+    language = escape(language or LANGUAGE)
+    return ('<?xml version="1.0" encoding="utf-8"?>\n<!DOCTYPE html>\n'
+            f'<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" '
+            f'lang="{language}" xml:lang="{language}"><head><title>{escape(title)}</title>'
+            '<link rel="stylesheet" type="text/css" href="style/default.css"/></head>'
+            f'<body>{minify_markup(body)}</body></html>')
+
+
+def minify_css(css):
+    """Drop comments and the whitespace around CSS punctuation"""
+    css = re.sub(r'/\*.*?\*/', '', css, flags=re.S)
+    css = re.sub(r'\s+', ' ', css)
+    css = re.sub(r'\s*([{};:,>])\s*', r'\1', css)
+    return css.replace(';}', '}').strip()
+
+
+PRE_BLOCK_PATTERN = re.compile(r'(<pre\b.*?</pre>)', re.S | re.I)
+# ASCII whitespace only, U+3000 indents and no-break spaces are visible text
+MARKUP_SPACE_PATTERN = re.compile(r'[ \t\r\n\f]+')
+# Whitespace next to these tags is never rendered
+BLOCK_TAG_SPACE_PATTERN = re.compile(
+    r'[ \t\r\n\f]*(</?(?:p|div|h[1-6]|ul|ol|li|dl|dt|dd|table|thead|tbody|tr|td|th|blockquote|figure|figcaption|'
+    r'section|article|header|footer|aside|nav|hr|html|head|body|title|link)\b[^>]*>)[ \t\r\n\f]*', re.I)
+
+
+def minify_markup(html):
+    """Collapse whitespace in XHTML markup, keeping <pre> blocks as they are"""
+    parts = PRE_BLOCK_PATTERN.split(html)
+    for i in range(0, len(parts), 2):
+        parts[i] = BLOCK_TAG_SPACE_PATTERN.sub(r'\1', MARKUP_SPACE_PATTERN.sub(' ', parts[i]))
+    return ''.join(parts)
+
+
+MARKUP_TAG_PATTERN = re.compile(r'<!--.*?-->|<(/?)([A-Za-z][\w:.-]*)[^>]*>', re.S)
+VOID_ELEMENTS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input', 'link', 'meta', 'param',
+                 'source', 'track', 'wbr'}
+BLOCK_ELEMENTS = {'p', 'div', 'section', 'article', 'main', 'header', 'footer', 'aside', 'blockquote', 'pre',
+                  'table', 'ul', 'ol', 'dl', 'figure', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'}
+# Elements that may be closed at a split and opened again in the next part
+SPLIT_CONTAINERS = {'div', 'section', 'article', 'main', 'blockquote'}
+
+
+def split_markup(html, target):
+    """
+    Split article markup after block elements into parts of about target bytes
+    
+    Parts are only cut where every open element is a plain container,
+    which is closed at the end of the part and opened again at the start
+    of the next one. A short remainder stays with the part before it.
+    
+    Returns:
+        List of markup parts, just [html] if it is small enough
+    """
+    if not target or len(html) < target // 4:
+        # Even all-CJK text (3 bytes a character) fits
+        return [html]
+    parts = []
+    stack = []  # (name, opening tag) of the elements open at the current position
+    start = last = size = 0
+    reopen = ''
+    for match in MARKUP_TAG_PATTERN.finditer(html):
+        closing, name = match.group(1), match.group(2)
+        if name is None:
+            continue
+        name = name.lower()
+        if not closing:
+            if name not in VOID_ELEMENTS and not match.group(0).endswith('/>'):
+                stack.append((name, match.group(0)))
+            continue
+        for depth in range(len(stack) - 1, -1, -1):
+            if stack[depth][0] == name:
+                del stack[depth:]
+                break
+        else:
+            continue
+        if name not in BLOCK_ELEMENTS or any(open_name not in SPLIT_CONTAINERS for open_name, _ in stack):
+            continue
+        end = match.end()
+        size += len(html[last:end].encode('utf-8'))
+        last = end
+        if size >= target and len(html) - end > target // 4:
+            parts.append(reopen + html[start:end] + ''.join(f'</{open_name}>' for open_name, _ in reversed(stack)))
+            reopen = ''.join(tag for _, tag in stack)
+            start, size = end, 0
+    parts.append(reopen + html[start:])
+    return parts
+
+
+def layout_chapters(articles, target=None):
+    """
+    Group the articles of a feed into chapter files of about target bytes
+    
+    Consecutive articles are merged until the next one would exceed the
+    target. Articles larger than the target get a file of their own and
+    are split by split_markup() when written.
+    
+    Returns:
+        List of article lists, one per chapter file
+    """
+    target = CHAPTER_TARGET_BYTES if target is None else target
+    if not target:
+        return [[article] for article in articles]
+    chapters = []
+    current, current_size = [], 0
+    for article in articles:
+        size = len(article['content'].encode('utf-8')) + 512
+        if current and current_size + size > target:
+            chapters.append(current)
+            current, current_size = [], 0
+        current.append(article)
+        current_size += size
+    if current:
+        chapters.append(current)
+    return chapters
+
+
+class EpubWriter:
+    """
+    Write an EPUB incrementally
+    
+    Every file is compressed into the ZIP container as soon as it is
+    added, so finished chapters and images do not stay in memory. How a
+    file is compressed depends on its media type (see ZIP_POLICY). The
+    package document, NCX and navigation document are written by close().
+    The book is built in a temporary file next to the output path and
+    atomically renamed over it, so readers never see a partial EPUB.
+    """
+    
+    def __init__(self, output_path, title, language, identifier, authors=(), date=None, policy=None, level=None):
+        self.output_path = output_path
+        self.tmp_path = output_path + ".part"
+        self.title = title
+        self.language = language
+        self.identifier = identifier
+        self.authors = list(authors)
+        self.date = date
+        self.policy = policy or ZIP_POLICY
+        self.level = ZIP_LEVEL if level is None else level
+        
+        self.manifest = []  # (item_id, href, media_type, properties)
+        self.spine = []     # (item_id, href, title) in reading order
+        self.toc = []       # (title, href)
+        self._ids = set()
+        
+        self._zip = zipfile.ZipFile(self.tmp_path, 'w', zipfile.ZIP_DEFLATED)
+        # The mimetype has to be the first entry and stored uncompressed
+        self._zip.writestr(zipfile.ZipInfo('mimetype'), 'application/epub+zip', compress_type=zipfile.ZIP_STORED)
+        self._zip.writestr('META-INF/container.xml', '''<?xml version="1.0" encoding="utf-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="EPUB/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+''', **self._compression('application/xml'))
+    
+    def _compression(self, media_type):
+        """ZipFile.writestr() / write() arguments for a file of the given media type"""
+        if self.policy == "store" or (self.policy == "auto" and media_type in COMPRESSED_MEDIA_TYPES):
+            return {'compress_type': zipfile.ZIP_STORED}
+        return {'compress_type': zipfile.ZIP_DEFLATED, 'compresslevel': self.level}
+    
+    def _register(self, href, media_type, properties=None):
+        """Add a manifest entry and return its id"""
+        item_id = re.sub(r'[^A-Za-z0-9_.-]', '_', href)
+        if not item_id[0].isalpha():
+            item_id = 'item_' + item_id
+        while item_id in self._ids:
+            item_id += '_'
+        self._ids.add(item_id)
+        self.manifest.append((item_id, href, media_type, properties))
+        return item_id
+    
+    def add_file(self, href, media_type, content, properties=None):
+        """Compress a file into the book right away"""
+        self._zip.writestr(f'EPUB/{href}', content, **self._compression(media_type))
+        return self._register(href, media_type, properties)
+    
+    def add_file_from_path(self, href, media_type, path, properties=None):
+        """Stream a file from disk into the book without loading it whole"""
+        self._zip.write(path, f'EPUB/{href}', **self._compression(media_type))
+        return self._register(href, media_type, properties)
+    
+    def add_document(self, href, title, content, position=None, toc=True):
+        """
+        Add an XHTML document to the book, the spine and the table of contents
+        
+        Args:
+            position: Index in the spine and table of contents,
+                appended at the end when None
+            toc: Add a table of contents entry for the document, entries
+                can also be added with add_toc_entry()
+        """
+        item_id = self.add_file(href, 'application/xhtml+xml', content)
+        if position is None:
+            position = len(self.spine)
+        self.spine.insert(position, (item_id, href, title))
+        if toc:
+            self.add_toc_entry(title, href, position)
+        return item_id
+    
+    def add_toc_entry(self, title, href, position=None):
+        """Add a table of contents entry, href may point at an anchor within a document"""
+        if position is None:
+            position = len(self.toc)
+        self.toc.insert(position, (title, href))
+    
+    def _nav_document(self):
+        items = '\n'.join(f'      <li><a href="{escape(href)}">{escape(title)}</a></li>' for title, href in self.toc)
+        return xhtml_page(self.title, f'''<nav epub:type="toc" id="toc">
+    <h1>{escape(self.title)}</h1>
+    <ol>
+{items}
+    </ol>
+</nav>''', self.language)
+    
+    def _ncx_document(self):
+        nav_points = '\n'.join(f'''    <navPoint id="navpoint-{i}" playOrder="{i}">
+      <navLabel><text>{escape(title)}</text></navLabel>
+      <content src="{escape(href)}"/>
+    </navPoint>''' for i, (title, href) in enumerate(self.toc, start=1))
+        return f'''<?xml version="1.0" encoding="utf-8"?>
+<ncx xmlns="http://www.daisy.org/z3986/2005/ncx/" version="2005-1">
+  <head>
+    <meta name="dtb:uid" content="{escape(self.identifier)}"/>
+    <meta name="dtb:depth" content="1"/>
+    <meta name="dtb:totalPageCount" content="0"/>
+    <meta name="dtb:maxPageNumber" content="0"/>
+  </head>
+  <docTitle><text>{escape(self.title)}</text></docTitle>
+  <navMap>
+{nav_points}
+  </navMap>
+</ncx>
+'''
+    
+    def _package_document(self):
+        modified = datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+        metadata = [
+            f'<dc:identifier id="id">{escape(self.identifier)}</dc:identifier>',
+            f'<dc:title>{escape(self.title)}</dc:title>',
+            f'<dc:language>{escape(self.language)}</dc:language>',
+        ]
+        metadata += [f'<dc:creator>{escape(author)}</dc:creator>' for author in self.authors]
+        if self.date:
+            metadata.append(f'<dc:date>{escape(self.date)}</dc:date>')
+        metadata.append(f'<meta property="dcterms:modified">{modified}</meta>')
+        cover_ids = [item_id for item_id, _, _, properties in self.manifest if properties == 'cover-image']
+        if cover_ids:
+            # EPUB 2 style cover hint, still used by some readers
+            metadata.append(f'<meta name="cover" content="{cover_ids[0]}"/>')
+        
+        manifest = [
+            f'<item id="{item_id}" href="{escape(href)}" media-type="{media_type}"'
+            + (f' properties="{properties}"' if properties else '') + '/>'
+            for item_id, href, media_type, properties in self.manifest
+        ]
+        spine = [f'<itemref idref="{item_id}"/>' for item_id, _, _ in self.spine]
+        newline = '\n    '
+        return f'''<?xml version="1.0" encoding="utf-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id" xml:lang="{self.language}">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    {newline.join(metadata)}
+  </metadata>
+  <manifest>
+    {newline.join(manifest)}
+  </manifest>
+  <spine toc="ncx">
+    {newline.join(spine)}
+  </spine>
+</package>
+'''
+    
+    def close(self):
+        """Write navigation and package documents, then move the book into place"""
+        self.add_file('nav.xhtml', 'application/xhtml+xml', self._nav_document(), properties='nav')
+        self._zip.writestr('EPUB/toc.ncx', self._ncx_document(), **self._compression('application/x-dtbncx+xml'))
+        self.manifest.append(('ncx', 'toc.ncx', 'application/x-dtbncx+xml', None))
+        self._zip.writestr('EPUB/content.opf', self._package_document(),
+                           **self._compression('application/oebps-package+xml'))
+        self._zip.close()
+        os.replace(self.tmp_path, self.output_path)
+    
+    def abort(self):
+        """Discard a partially written book"""
+        try:
+            self._zip.close()
+        except Exception:
+            pass
+        try:
+            os.remove(self.tmp_path)
+        except OSError:
+            pass
+
+
+def collect_articles(feeds, prepared=None):
+    """
+    Clean every article and gather its images before building chapters
+    
+    Articles are reduced to plain dicts, so they can be handed to the
+    processes writing EPUB volumes.
+    
+    Args:
+        feeds: Parsed feeds
+        prepared: Articles cleaned earlier by article_id(), e.g. from the
+            warm store; they are used as they are
+    
+    Returns:
+        (feed_articles, image_urls, image_budgets) where feed_articles is
+        a list of (feed_title, articles) tuples in feed order and
+        image_budgets holds the bytes left for images of each feed
+        (None for no limit)
+    """
+    feed_articles = []
+    image_urls = []
+    image_budgets = []
+    for feed_index, feed in enumerate(feeds):
+        if not feed.entries:
+            continue
+        
+        options = feed.options or DEFAULT_FEED_OPTIONS
+        feed_title = feed.title or f"Feed {feed_index+1}"
+        articles = []
+        for entry in feed.entries:
+            article = prepared.get(entry.id) if prepared else None
+            if article is not None:
+                metrics.count('articles')
+                metrics.count('articles_prepared')
+                metrics.count('images_referenced', len(article['images']))
+                image_urls.extend(image[0] for image in article['images'])
+                articles.append(article)
+                continue
+            
+            # Get article content
+            content = entry.content
+            if not content:
+                content = f"<p>Could not retrieve article content. Please visit <a href='{entry.link}'>{entry.link}</a></p>"
+            
+            # Clean HTML content, images are left as placeholders
+            content, images = clean_html(content, entry.link,
+                                         max_images=options['max_images'], text_only=options['text_only'])
+            metrics.count('articles')
+            metrics.count('images_referenced', len(images))
+            image_urls.extend(image[0] for image in images)
+            articles.append({
+                'id': entry.id,
+                'title': entry.title,
+                'link': entry.link,
+                'published': entry.published,
+                'content': content,
+                'images': images,
+            })
+        feed_articles.append((feed_title, articles))
+        if options['max_bytes']:
+            text_bytes = sum(len(article['content'].encode('utf-8')) for article in articles)
+            image_budgets.append(max(0, options['max_bytes'] - text_bytes))
+        else:
+            image_budgets.append(None)
+    return feed_articles, image_urls, image_budgets
+
+
+def apply_image_budgets(feed_articles, processed_images, image_budgets):
+    """
+    Leave out images of feeds whose max_bytes budget is used up
     
-    return str(soup)
+    Downloads already stop once the raw image bytes of a feed exceed its
+    budget (see image_download_budgets()). This is the final trim: images
+    are counted in article order by their processed size, an image used
+    twice in a feed is counted once. Images over the budget are removed
+    from the article.
+    """
+    for (feed_title, articles), budget in zip(feed_articles, image_budgets):
+        if budget is None:
+            continue
+        used, counted, dropped = 0, set(), 0
+        for article in articles:
+            for index, (img_url, alt, original_markup) in enumerate(article['images']):
+                if img_url not in processed_images:
+                    continue
+                content_hash, extension, _ = processed_images[img_url]
+                if content_hash in counted:
+                    continue
+                try:
+                    size = os.path.getsize(_image_cache_file(content_hash, extension))
+                except OSError:
+                    continue
+                if used + size > budget:
+                    # An unknown URL with empty markup removes the image
+                    article['images'][index] = (None, alt, '')
+                    dropped += 1
+                    continue
+                used += size
+                counted.add(content_hash)
+        if dropped:
+            print(f"Left out {dropped} images of {feed_title} to stay within its max_bytes budget")
+            metrics.count('images_over_budget', dropped)
 
-def generate_identicon(width=1264, height=1680, block_size=140, background_color=(255, 255, 255), colors=None):
+
+def write_epub(output_path, title, feed_articles, processed_images, seed=None):
     """
-    Generate a random identicon similar to GitHub default avatars, with fixed resolution for Kobo
+    Write one EPUB with a cover, a contents page and chapters laid out by layout_chapters()
     
     Args:
-        width: Image width in pixels (1264 for Kobo)
-        height: Image height in pixels (1680 for Kobo)
-        block_size: Size of each block in the grid
-        background_color: Background color as RGB tuple
-        colors: List of colors to use for blocks, if None random colors will be used
+        output_path: EPUB file to create, it appears there once complete
+        title: Book title
+        feed_articles: (feed_title, articles) tuples from collect_articles()
+        processed_images: Results of prepare_images() for one profile
+        seed: Cover seed from cover_seed(), None for a random cover
         
     Returns:
-        PIL Image object with the generated identicon
+        Number of articles written
     """
-    print("Generating random identicon cover image...")
-    
-    # Calculate grid dimensions
-    grid_width = width // block_size
-    grid_height = height // block_size
-    
-    # Make grid width odd for symmetry
-    if grid_width % 2 == 0:
-        grid_width -= 1
-    
-    # Create a new image with white background
-    img = Image.new('RGB', (width, height), background_color)
-    draw = ImageDraw.Draw(img)
+    current_date = datetime.datetime.now().strftime('%Y-%m-%d')
+    print(f"Writing EPUB file to: {output_path}")
     
-    # Generate random colors if not provided
-    if colors is None:
-        # Generate a random highlight color (more vibrant)
-        hue = random.randint(0, 360)
-        saturation = random.randint(70, 100)
-        value = random.randint(50, 90)
+    book = EpubWriter(
+        output_path,
+        title=title,
+        language=LANGUAGE,
+        identifier=f"urn:uuid:{uuid.uuid4()}",
+        authors=["GitHub @IcingTomato", "RSS Feed Reader"],
+        date=current_date,
+    )
+    try:
+        book.add_file('style/default.css', 'text/css', minify_css(EPUB_STYLE))
         
-        # Convert HSV to RGB
-        h_float = hue / 360.0
-        s_float = saturation / 100.0
-        v_float = value / 100.0
+        with metrics.stage('cover'):
+            # Identicon as cover image, random unless --cover-seed is given
+            cover = cover_png(seed, width=SCREEN_WIDTH, height=SCREEN_HEIGHT, block_size=140)
+            book.add_file('images/cover.png', 'image/png', cover, properties='cover-image')
+            del cover
         
-        if h_float == 0:
-            r, g, b = v_float, v_float, v_float
-        else:
-            i = int(h_float * 6.0)
-            f = (h_float * 6.0) - i
-            p = v_float * (1.0 - s_float)
-            q = v_float * (1.0 - s_float * f)
-            t = v_float * (1.0 - s_float * (1.0 - f))
-            i = i % 6
+        # Create cover page
+        book.add_document('cover.xhtml', 'Cover', xhtml_page('Cover', '''<div style="text-align: center;">
+    <img src="images/cover.png" alt="Cover" class="cover-image"/>
+</div>'''))
+        
+        # Create table of contents (written once all chapters are known)
+        toc_content = f'''<h1>Contents</h1>
+<p>{escape(title)}</p>
+'''
+        
+        article_count = 0
+        file_count = 0
+        added_images = set()
+        
+        def add_chapter_file(file_title, body, entries=()):
+            """
+            Write one chapter file and its table of contents entries
             
-            if i == 0: r, g, b = v_float, t, p
-            elif i == 1: r, g, b = q, v_float, p
-            elif i == 2: r, g, b = p, v_float, t
-            elif i == 3: r, g, b = p, q, v_float
-            elif i == 4: r, g, b = t, p, v_float
-            elif i == 5: r, g, b = v_float, p, q
+            Args:
+                entries: (title, anchor, is_article) tuples, anchor is None
+                    for the top of the file
+                
+            Returns:
+                Contents page lines of the articles in the file
+            """
+            nonlocal file_count
+            file_count += 1
+            href = f'chapter_{file_count}.xhtml'
+            book.add_document(href, file_title, xhtml_page(file_title, body), toc=False)
+            metrics.count('chapter_files')
+            lines = ''
+            for entry_title, anchor, is_article in entries:
+                link = f'{href}#{anchor}' if anchor else href
+                book.add_toc_entry(entry_title, link)
+                if is_article:
+                    lines += f'<li><a href="{link}">{escape(entry_title)}</a></li>\n'
+            return lines
         
-        color = (int(r * 255), int(g * 255), int(b * 255))
-    else:
-        color = random.choice(colors)
+        with metrics.stage('write_chapters'):
+            # Process each feed
+            for feed_index, (feed_title, articles) in enumerate(feed_articles):
+                # Add feed title to TOC
+                toc_content += f'<h2>{escape(feed_title)}</h2>\n<ul>\n'
+                
+                # The feed title opens the feed's first chapter file
+                body = [f'<h1>{escape(feed_title)}</h1>']
+                entries = [(feed_title, None, False)]
+                
+                # Articles are merged into or split across files of about CHAPTER_TARGET_BYTES
+                for chapter in layout_chapters(articles):
+                    parts = []
+                    for article in chapter:
+                        article_count += 1
+                        article_title = article['title']
+                        print(f"Processing article: {article_title}")
+                        
+                        # Attach downloaded images
+                        content = attach_images(article['content'], article['images'], processed_images, book, added_images)
+                        if len(chapter) == 1:
+                            parts = split_markup(content, CHAPTER_TARGET_BYTES)
+                            content = parts[0]
+                        
+                        # Set chapter content
+                        published_date = ""
+                        if article['published']:
+                            published_date = f"<p>Published: {escape(article['published'])}</p>"
+                        
+                        # Every article starts on a new page
+                        anchor = f'article_{article_count}'
+                        page_break = ' class="page-break"' if body else ''
+                        body.append(f'''<div{page_break} id="{anchor}">
+<h1>{escape(article_title)}</h1>
+<h2>From: {escape(feed_title)}</h2>
+{published_date}
+<p><a href="{escape(article['link'])}">Original Link</a></p>
+<div>{content}</div>
+</div>''')
+                        entries.append((article_title, anchor if len(body) > 1 else None, True))
+                        metrics.count('chapters')
+                    
+                    # Add chapter to book, it is compressed to disk right away
+                    toc_content += add_chapter_file(chapter[0]['title'], ''.join(body), entries)
+                    body, entries = [], []
+                    
+                    # Parts of a long article continue in files of their own
+                    for part in parts[1:]:
+                        add_chapter_file(chapter[0]['title'], f'<div><div>{part}</div></div>')
+                
+                if body:
+                    # A feed left without articles still gets its title page
+                    add_chapter_file(feed_title, ''.join(body), entries)
+                toc_content += '</ul>\n'
+        
+        with metrics.stage('finalize_epub'):
+            # The contents page follows the cover in the spine
+            book.add_document('toc.xhtml', 'Contents', xhtml_page('Contents', toc_content), position=1)
+            
+            # Write navigation, package document and move the file into place
+            book.close()
+    except BaseException:
+        book.abort()
+        raise
     
-    print(f"Using color: RGB{color} for identicon")
+    try:
+        os.chmod(output_path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
+        print(f"Set file permissions for: {output_path}")
+    except Exception as e:
+        print(f"Could not set file permissions: {e}")
     
-    # Generate half of the random pattern (for horizontal symmetry)
-    half_grid_width = grid_width // 2 + 1
-    pattern = []
+    print(f"EPUB file successfully created: {output_path}")
+    return article_count
+
+
+def _estimated_article_bytes(article, processed_images, counted_images):
+    """Rough compressed size an article adds to a volume, images included"""
+    # Article text deflates to about a third of its size
+    size = len(article['content']) // 3 + 512
+    for img_url, _, _ in article['images']:
+        if img_url in processed_images:
+            content_hash, extension, _ = processed_images[img_url]
+            if content_hash not in counted_images:
+                counted_images.add(content_hash)
+                try:
+                    size += os.path.getsize(_image_cache_file(content_hash, extension))
+                except OSError:
+                    pass
+    return size
+
+
+def plan_volumes(feed_articles, processed_images, mode=None, max_bytes=None, max_chapters=None):
+    """
+    Split feeds into volumes
     
-    # Create a pattern for the entire height
-    for i in range(grid_height):
-        row = []
-        for j in range(half_grid_width):
-            # More filled blocks than empty (70% chance of a block)
-            if random.random() < 0.7:
-                row.append(1)
-            else:
-                row.append(0)
-        pattern.append(row)
+    Articles keep their order. With mode "feed" every feed starts a new
+    volume; in any mode a volume is closed at an article boundary when
+    the next article would exceed max_bytes (estimated) or max_chapters.
+    A single article larger than the budget gets a volume of its own.
     
-    # Draw the pattern with horizontal symmetry
-    for i in range(grid_height):
-        for j in range(half_grid_width):
-            if pattern[i][j]:
-                # Left side
-                x = j * block_size
-                y = i * block_size
-                draw.rectangle([x, y, x + block_size, y + block_size], fill=color)
-                
-                # Right side (mirror)
-                mirror_j = grid_width - j - 1
-                if mirror_j != j:  # Don't duplicate the middle column
-                    x = mirror_j * block_size
-                    y = i * block_size
-                    draw.rectangle([x, y, x + block_size, y + block_size], fill=color)
+    Args:
+        feed_articles: (feed_title, articles) tuples from collect_articles()
+        processed_images: Results of prepare_images() for one profile
+        mode: "none", "feed" or "size" (defaults to SPLIT_MODE)
+        max_bytes: Size budget per volume, 0 for none (defaults to VOLUME_MAX_BYTES)
+        max_chapters: Articles per volume, 0 for no limit (defaults to VOLUME_MAX_CHAPTERS)
+        
+    Returns:
+        List of volumes, each a list of (feed_title, articles) tuples
+    """
+    mode = mode or SPLIT_MODE
+    if mode == "none":
+        return [feed_articles]
+    max_bytes = VOLUME_MAX_BYTES if max_bytes is None else max_bytes
+    max_chapters = VOLUME_MAX_CHAPTERS if max_chapters is None else max_chapters
     
-    print("Random identicon generated")
-    return img
+    volumes = []
+    current, size, chapters, counted_images = [], 0, 0, set()
+    
+    def close_volume():
+        nonlocal current, size, chapters, counted_images
+        if current:
+            volumes.append(current)
+        current, size, chapters, counted_images = [], 0, 0, set()
+    
+    for feed_title, articles in feed_articles:
+        if mode == "feed":
+            close_volume()
+        group = None
+        for article in articles:
+            article_images = set(counted_images)
+            article_size = _estimated_article_bytes(article, processed_images, article_images)
+            full = ((max_bytes and size + article_size > max_bytes)
+                    or (max_chapters and chapters >= max_chapters))
+            if full and chapters:
+                close_volume()
+                group = None
+                article_images = set()
+                article_size = _estimated_article_bytes(article, processed_images, article_images)
+            if group is None:
+                # A feed split across volumes gets its section in each of them
+                group = (feed_title, [])
+                current.append(group)
+            group[1].append(article)
+            counted_images = article_images
+            size += article_size
+            chapters += 1
+    close_volume()
+    return volumes
+
+
+def _write_volume_job(job):
+    """Write one volume in a worker process with the settings of its profile, return (path, chapters)"""
+    output_path, title, feed_articles, processed_images, seed, settings = job
+    globals().update(settings)
+    return output_path, write_epub(output_path, title, feed_articles, processed_images, seed)
 
-def create_combined_epub(feeds):
-    """Create EPUB file from multiple RSS feeds"""
-    # Initialize EPUB book
-    book = epub.EpubBook()
+
+def volume_seed(feed_articles, volume_number=None):
+    """Cover seed of a volume, see cover_seed()"""
+    seed = cover_seed(article['id'] for _, articles in feed_articles for article in articles)
+    if seed is not None and volume_number is not None and COVER_SEED == "date":
+        # One cover per day and volume
+        seed = f"{seed}-{volume_number}"
+    return seed
+
+
+def remove_stale_volumes(output_dir, keep):
+    """Remove today's EPUBs from an earlier run that this run does not overwrite"""
+    pattern = re.compile(re.escape(output_basename()) + r'(_\d+)?\.epub')
+    for name in os.listdir(output_dir):
+        if pattern.fullmatch(name) and name not in keep:
+            try:
+                os.remove(os.path.join(output_dir, name))
+                print(f"Removed outdated EPUB: {name}")
+            except OSError as e:
+                print(f"Could not remove outdated EPUB {name}: {e}")
+
+
+def create_combined_epub(feeds, output_dir=None, prepared=None, profiles=None):
+    """
+    Create EPUB files from multiple RSS feeds, streaming them to disk as they are built
+    
+    Articles are cleaned and images downloaded once, then rendered for
+    every output profile with its own image settings, output directory
+    and language (see read_profiles()). Everything goes into one EPUB per
+    profile unless its split mode splits the articles into volumes (see
+    plan_volumes()). Volumes of all profiles are written together by a
+    pool of VOLUME_WORKERS processes; each appears in its output
+    directory as soon as it is complete, so the first ones can be opened
+    while the rest are still being written.
     
+    Args:
+        feeds: Parsed feeds
+        output_dir: Directory for the EPUBs (defaults to OUTPUT_DIR), when no profiles are given
+        prepared: Articles already cleaned, see collect_articles()
+        profiles: (name, settings) tuples from read_profiles(), None for the command line settings
+        
+    Returns:
+        (paths, delivered) tuple: EPUB paths by profile and in reading
+        order, and the ids of the articles in them. An article of a volume
+        that could not be written is not delivered, in any profile.
+    """
     # Set book metadata
     current_date = datetime.datetime.now().strftime('%Y-%m-%d')
     book_title = f"RSS Feeds {current_date}"
     print(f"Creating EPUB titled: {book_title}")
     
-    book.set_title(book_title)
-    # book.set_language('en')
-    book.set_language('zh-CN')
-    book.add_author("GitHub @IcingTomato")
+    if not profiles:
+        name, settings = default_profile()
+        settings['OUTPUT_DIR'] = output_dir or OUTPUT_DIR
+        profiles = [(name, settings)]
+    
+    with metrics.stage('full_text'):
+        fetch_full_articles(feeds, prepared)
+    with metrics.stage('clean_html'):
+        feed_articles, image_urls, image_budgets = collect_articles(feeds, prepared)
+    
+    # Download all images once and resize them for every profile, feeds with max_bytes stop
+    # downloading once their raw image bytes are over budget
+    with metrics.stage('images'):
+        profile_images = prepare_images(image_urls, [profile_image_settings(settings) for _, settings in profiles],
+                                        feed_budgets=image_download_budgets(feed_articles, image_budgets))
+    
+    # Worker processes get the settings changed by command line options and the profile
+    shared_settings = {name: globals()[name] for name in (
+        'CACHE_DIR', 'IMAGE_CACHE_DIR', 'COVER_CACHE_DIR', 'COVER_SEED')}
+    jobs = []
+    for (name, settings), processed_images in zip(profiles, profile_images):
+        if name:
+            print(f"Rendering profile {name} to {settings['OUTPUT_DIR']}")
+        # Image budgets drop images from the articles, so each profile gets its own lists
+        articles = [(feed_title, [dict(article, images=list(article['images'])) for article in feed_article_list])
+                    for feed_title, feed_article_list in feed_articles]
+        with applied_settings(settings):
+            apply_image_budgets(articles, processed_images, image_budgets)
+            volumes = plan_volumes(articles, processed_images)
+            os.makedirs(OUTPUT_DIR, exist_ok=True)
+            profile_jobs = []
+            for number, volume in enumerate(volumes, 1):
+                if len(volumes) == 1:
+                    output_path = os.path.join(OUTPUT_DIR, output_basename() + ".epub")
+                    title, seed = book_title, volume_seed(volume)
+                else:
+                    output_path = os.path.join(OUTPUT_DIR, f"{output_basename()}_{number}.epub")
+                    title = f"{book_title} ({number}/{len(volumes)})"
+                    seed = volume_seed(volume, number)
+                profile_jobs.append((output_path, title, volume, processed_images, seed,
+                                     dict(shared_settings, **settings)))
+            remove_stale_volumes(OUTPUT_DIR, keep={os.path.basename(job[0]) for job in profile_jobs})
+        jobs.extend(profile_jobs)
+    
+    def article_ids(job):
+        return {article['id'] for _, articles in job[2] for article in articles}
+    
+    if len(jobs) == 1:
+        output_path, title, volume, processed_images, seed, settings = jobs[0]
+        with applied_settings(settings):
+            write_epub(output_path, title, volume, processed_images, seed)
+        return [output_path], article_ids(jobs[0])
+    metrics.count('volumes', len(jobs))
+    
+    workers = max(1, min(VOLUME_WORKERS, len(jobs)))
+    print(f"Writing {len(jobs)} volumes with {workers} worker processes...")
+    
+    written = {}
+    with metrics.stage('write_volumes'):
+        # The process pool module is only loaded when volumes are written
+        ProcessPoolExecutor = lazy_import('concurrent.futures.process').ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # Volumes are submitted in reading order, so the first ones finish first
+            futures = {executor.submit(_write_volume_job, job): job[0] for job in jobs}
+            for future in as_completed(futures):
+                try:
+                    output_path, chapters = future.result()
+                except Exception as e:
+                    print(f"Error writing volume {futures[future]}: {e}")
+                    metrics.error('volume', f"{futures[future]}: {e}")
+                    continue
+                metrics.count('chapters', chapters)
+                written[output_path] = chapters
+                print(f"Volume ready ({len(written)}/{len(jobs)}): {output_path}")
+    
+    if not written:
+        raise RuntimeError("No EPUB volume could be written")
+    delivered, failed = set(), set()
+    for job in jobs:
+        (delivered if job[0] in written else failed).update(article_ids(job))
+    return [job[0] for job in jobs if job[0] in written], delivered - failed
 
-    simple_id = f"rss-feeds-{datetime.datetime.now().strftime('%Y%m%d')}"
-    book.set_identifier(simple_id)
 
-    book.set_identifier(str(uuid.uuid4()))
-    book.add_metadata('DC', 'creator', 'RSS Feed Reader')
-    book.add_metadata('DC', 'date', current_date)
+@contextlib.contextmanager
+def cache_lock():
+    """
+    Hold the cache lock, so the daemon and a menu run never update the caches at once
     
-    # Create chapter lists
-    chapters = []
-    toc = []
-    
-    # Add CSS style
-    style = '''
-    body { 
-        font-family: sans-serif; 
-        font-size: 0.9em;  
-        line-height: 1.4; 
-    }
-    h1 { 
-        text-align: center; 
-        font-size: 1.1em;  
-        margin: 0.8em 0;   
-    }
-    h2 { 
-        text-align: center; 
-        font-size: 0.9em;  
-        margin: 0.8em 0;   
-        color: #555; 
-    }
-    h3 { 
-        font-size: 0.8em;  
-        margin: 0.6em 0; 
-    }
-    p { 
-        font-size: 0.85em; 
-        margin: 0.5em 0; 
-    }
-    img { 
-        max-width: 100%; 
-        height: auto; 
-    }
-    .cover-image { 
-        display: block; 
-        margin: 0 auto; 
-        max-width: 100%; 
-    }
-    a {
-        font-size: 0.8em;  
-    }
-    .image-container {
-        text-align: center;
-        margin: 1em 0;
+    Waits for the other process if it holds the lock. Without fcntl
+    (not on the Kobo) no locking is done.
+    """
+    try:
+        import fcntl
+    except ImportError:
+        yield
+        return
+    os.makedirs(os.path.dirname(CACHE_LOCK_PATH), exist_ok=True)
+    with open(CACHE_LOCK_PATH, 'w') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            print("Waiting for the background refresh to finish...")
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def reset_run_state():
+    """Forget per-run state, so each daemon refresh starts like a new run"""
+    global metrics, _feed_cache_db, _image_cache_index, _host_health
+    metrics = RunMetrics()
+    # Indexes are reloaded from disk, a menu run may have changed them
+    _feed_cache_db = None
+    _image_cache_index = None
+    _image_cache_in_use.clear()
+    _host_health = None
+    _host_run_results.clear()
+
+
+def config_signature(links):
+    """Links and their options, to tell whether the warm store matches config"""
+    return [(link, sorted(FEED_OPTIONS.get(link, {}).items())) for link in links]
+
+
+def save_warm_store(links, feeds, articles):
+    """Store fetched feeds and their cleaned articles for the next menu run"""
+    store = {
+        'version': WARM_STORE_VERSION,
+        'refreshed': time.time(),
+        'config': config_signature(links),
+        'feeds': feeds,
+        'articles': articles,
     }
-    '''
-    css = epub.EpubItem(
-        uid="style_default",
-        file_name="style/default.css",
-        media_type="text/css",
-        content=style
-    )
-    book.add_item(css)
+    try:
+        os.makedirs(os.path.dirname(WARM_STORE_PATH), exist_ok=True)
+        with open(WARM_STORE_PATH + ".tmp", 'wb') as f:
+            pickle.dump(store, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(WARM_STORE_PATH + ".tmp", WARM_STORE_PATH)
+    except OSError as e:
+        print(f"Could not save warm store: {e}")
+
+
+def load_warm_store(links):
+    """
+    Load the warm store if it is fresh and was made from the current config
     
-    # Random identicon as cover image
-    identicon = generate_identicon(width=1264, height=1680, block_size=140)
+    Returns:
+        Store dict with "refreshed", "feeds" and "articles", or None
+    """
+    try:
+        with open(WARM_STORE_PATH, 'rb') as f:
+            store = pickle.load(f)
+    except Exception:
+        return None
+    if store.get('version') != WARM_STORE_VERSION:
+        return None
+    age = time.time() - store.get('refreshed', 0)
+    if age > WARM_STORE_MAX_AGE:
+        print(f"Warm store is {age / 3600:.1f} hours old, fetching feeds instead")
+        return None
+    if store.get('config') != config_signature(links):
+        print("Config changed since the last background refresh, fetching feeds instead")
+        return None
+    return store
+
+
+def refresh_warm_store():
+    """
+    Fetch all feeds, clean their articles and prepare their images
     
-    # Convert identicon to bytes
-    import io
-    img_bytes = io.BytesIO()
-    identicon.save(img_bytes, format='PNG')
-    cover_image_content = img_bytes.getvalue()
-    
-    # Create cover image item
-    cover_image = epub.EpubItem(
-        uid="cover_image",
-        file_name="images/cover.png",
-        media_type="image/png",
-        content=cover_image_content
-    )
-    book.add_item(cover_image)
-    
-    # Set cover image
-    # book.set_cover("images/cover.png", cover_image_content)
-    
-    # Create cover page
-    cover = epub.EpubHtml(title='Cover', file_name='cover.xhtml')
-    cover.content = f'''
-    <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">
-    <html xmlns="http://www.w3.org/1999/xhtml">
-    <head>
-        <title>Cover</title>
-        <link rel="stylesheet" type="text/css" href="style/default.css"/>
-    </head>
-    <body>
-        <div style="text-align: center;">
-            <img src="images/cover.png" alt="Cover" style="max-width: 100%; height: auto;"/>
-        </div>
-    </body>
-    </html>
-    '''
-    
-    book.add_item(cover)
-    chapters.append(cover)
-    toc.append(cover)
-    
-    # Create table of contents
-    toc_page = epub.EpubHtml(title='Contents', file_name='toc.xhtml')
-    toc_content = f'''
-    <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">
-    <html xmlns="http://www.w3.org/1999/xhtml">
-    <head>
-        <title>Contents</title>
-        <link rel="stylesheet" type="text/css" href="style/default.css"/>
-    </head>
-    <body>
-        <h1>Contents</h1>
-        <p>RSS Collection {current_date}</p>
-    '''
-    
-    chapter_index = 0
-    
-    # Process each feed
-    for feed_index, feed in enumerate(feeds):
-        if not feed.entries:
-            continue
-            
-        # Add feed title to TOC
-        feed_title = feed.feed.title if hasattr(feed.feed, 'title') else f"Feed {feed_index+1}"
-        toc_content += f'<h2>{feed_title}</h2>\n<ul>\n'
-        
-        # Add feed section
-        feed_section = epub.EpubHtml(
-            title=feed_title,
-            file_name=f'feed_{feed_index}.xhtml'
-        )
-        feed_section.content = f'''
-        <html>
-        <head>
-            <title>{feed_title}</title>
-            <link rel="stylesheet" href="style/default.css" />
-        </head>
-        <body>
-            <h1>{feed_title}</h1>
-        </body>
-        </html>
-        '''
-        book.add_item(feed_section)
-        chapters.append(feed_section)
-        toc.append(feed_section)
-        
-        # Process each article in the feed
-        for entry_index, entry in enumerate(feed.entries):
-            chapter_index += 1
-            title = entry.title
-            print(f"Processing article: {title}")
-            
-            # Get article content
-            if hasattr(entry, 'content'):
-                content = entry.content[0].value
-            elif hasattr(entry, 'description'):
-                content = entry.description
-            else:
-                content = f"<p>Could not retrieve article content. Please visit <a href='{entry.link}'>{entry.link}</a></p>"
-            
-            # Clean HTML content
-            content = clean_html(content)
-            
-            # Download images
-            content = download_images(content, book, f"{feed_index}_{entry_index}")
-            
-            # Create chapter
-            chapter = epub.EpubHtml(
-                title=title,
-                file_name=f'chapter_{chapter_index}.xhtml'
-            )
-            
-            # Set chapter content
-            published_date = ""
-            if hasattr(entry, 'published'):
-                published_date = f"<p>Published: {entry.published}</p>"
-                
-            chapter.content = f'''
-            <!DOCTYPE html PUBLIC "-//W3C//DTD XHTML 1.1//EN" "http://www.w3.org/TR/xhtml11/DTD/xhtml11.dtd">
-            <html xmlns="http://www.w3.org/1999/xhtml">
-            <head>
-                <title>{title}</title>
-                <link rel="stylesheet" type="text/css" href="style/default.css"/>
-            </head>
-            <body>
-                <h1>{title}</h1>
-                <h2>From: {feed_title}</h2>
-                {published_date}
-                <p><a href="{entry.link}">Original Link</a></p>
-                <div>{content}</div>
-            </body>
-            </html>
-            '''
-            
-            # Add chapter to book
-            book.add_item(chapter)
-            chapters.append(chapter)
-            toc.append(chapter)
-            
-            # Add entry to TOC
-            toc_content += f'<li><a href="chapter_{chapter_index}.xhtml">{title}</a></li>\n'
-        
-        toc_content += '</ul>\n'
+    Everything lands in the caches and the warm store, so a menu run
+    afterwards only assembles the EPUB.
     
-    toc_content += '''
-    </body>
-    </html>
-    '''
-    toc_page.content = toc_content
-    book.add_item(toc_page)
-    chapters.insert(1, toc_page)
-    toc.insert(1, toc_page)
+    Returns:
+        Short description of the refresh for the status file
+    """
+    start_deadline()
+    links = read_config()
+    if not links:
+        return "no RSS links in config"
     
-    # Create table of contents
-    book.toc = toc
+    preload_modules()
+    fetched = fetch_all_feeds(links)
+    feeds = [feed for _, feed, _ in fetched if feed.entries]
+    # Feeds are stored whole, the menu run drops the same duplicates again
+    unique = [Feed(feed.url, feed.title, list(feed.entries), feed.options) for feed in feeds]
+    if DEDUPLICATE:
+        drop_duplicate_entries(unique)
+    fetch_full_articles(unique)
+    feed_articles, image_urls, image_budgets = collect_articles(unique)
+    profiles = (read_profiles() if RENDER_PROFILES_PATH else None) or [default_profile()]
+    prepare_images(image_urls, [profile_image_settings(settings) for _, settings in profiles],
+                   feed_budgets=image_download_budgets(feed_articles, image_budgets))
     
-    # Add default NCX and Nav
-    nav = epub.EpubNav()
-    book.add_item(nav)
+    articles = {article['id']: article for _, feed_article_list in feed_articles for article in feed_article_list}
+    save_warm_store(links, feeds, articles)
+    save_host_health()
+    return f"{len(feeds)}/{len(links)} feeds, {len(articles)} articles"
+
+
+def network_available():
+    """True when a network interface other than loopback is up (Wi-Fi on the Kobo)"""
+    try:
+        names = os.listdir('/sys/class/net')
+    except OSError:
+        # No way to tell, let the requests find out
+        return True
+    for name in names:
+        if name == 'lo':
+            continue
+        try:
+            with open(os.path.join('/sys/class/net', name, 'operstate')) as f:
+                if f.read().strip() == 'up':
+                    return True
+        except OSError:
+            continue
+    return False
+
+
+def write_daemon_status(state, last_refresh=None, result=None, next_refresh=None):
+    """Write the daemon state shown by "Check RSS Status" in NickelMenu"""
+    def when(timestamp):
+        return datetime.datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d %H:%M')
     
-    ncx = epub.EpubNcx()
-    book.add_item(ncx)
+    lines = [f"RSS daemon: {state}"]
+    if last_refresh:
+        lines.append(f"Last refresh: {when(last_refresh)} ({result})")
+    if next_refresh:
+        lines.append(f"Next refresh: {when(next_refresh)}")
+    try:
+        os.makedirs(os.path.dirname(DAEMON_STATUS_PATH), exist_ok=True)
+        with open(DAEMON_STATUS_PATH + ".tmp", 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.replace(DAEMON_STATUS_PATH + ".tmp", DAEMON_STATUS_PATH)
+    except OSError as e:
+        print(f"Could not write daemon status: {e}")
+
+
+def run_daemon(interval=None):
+    """
+    Refresh the warm store every interval seconds while the network is up
     
-    # Set spine
-    # book.spine = ['nav'] + chapters
-    book.spine = [cover] + chapters[1:] 
+    Runs until SIGTERM or SIGINT. Only one daemon runs at a time.
+    """
+    import signal
+    interval = interval or DAEMON_INTERVAL
+    os.makedirs(os.path.dirname(DAEMON_PID_PATH), exist_ok=True)
+    pid_file = open(DAEMON_PID_PATH, 'a+')
+    try:
+        import fcntl
+        fcntl.flock(pid_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except ImportError:
+        pass
+    except OSError:
+        print("The RSS daemon is already running")
+        return
+    pid_file.seek(0)
+    pid_file.truncate()
+    pid_file.write(str(os.getpid()))
+    pid_file.flush()
     
-    # Generate output filename and path
-    output_dir = "/mnt/onboard/RSS"
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
+    stop = threading.Event()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda *args: stop.set())
     
-    output_filename = f"RSSFeeds_{datetime.datetime.now().strftime('%Y%m%d')}.epub"
-    output_path = os.path.join(output_dir, output_filename)
+    print(f"RSS daemon started, refreshing every {interval // 60:.0f} minutes")
+    last_refresh, result = None, None
+    while not stop.is_set():
+        if not network_available():
+            write_daemon_status("waiting for Wi-Fi", last_refresh, result)
+            stop.wait(NETWORK_POLL_INTERVAL)
+            continue
+        
+        write_daemon_status("refreshing", last_refresh, result)
+        reset_run_state()
+        try:
+            with cache_lock():
+                result = refresh_warm_store()
+            last_refresh = time.time()
+        except Exception as e:
+            print(f"Background refresh failed: {e}")
+            result = f"failed: {e}"
+        print(f"Background refresh done: {result}")
+        write_daemon_status("sleeping", last_refresh, result, time.time() + interval)
+        stop.wait(interval)
     
-    # Write EPUB file
-    print(f"Writing EPUB file to: {output_path}")
-    epub.write_epub(output_path, book)
+    write_daemon_status("stopped", last_refresh, result)
+    pid_file.close()
+
+
+def set_cache_dir(cache_dir):
+    """Move all on-disk caches below another directory"""
+    global CACHE_DIR, FEED_CACHE_PATH, SEEN_INDEX_PATH, IMAGE_CACHE_DIR, COVER_CACHE_DIR, HOST_HEALTH_PATH
+    global WARM_STORE_PATH, DAEMON_STATUS_PATH, DAEMON_PID_PATH, CACHE_LOCK_PATH
+    CACHE_DIR = cache_dir
+    FEED_CACHE_PATH = os.path.join(cache_dir, "feeds.sqlite3")
+    SEEN_INDEX_PATH = os.path.join(cache_dir, "seen.sqlite3")
+    IMAGE_CACHE_DIR = os.path.join(cache_dir, "images")
+    HOST_HEALTH_PATH = os.path.join(cache_dir, "hosts.json")
+    WARM_STORE_PATH = os.path.join(cache_dir, "store.pickle")
+    DAEMON_STATUS_PATH = os.path.join(cache_dir, "daemon.txt")
+    DAEMON_PID_PATH = os.path.join(cache_dir, "daemon.pid")
+    CACHE_LOCK_PATH = os.path.join(cache_dir, ".lock")
+    COVER_CACHE_DIR = os.path.join(cache_dir, "covers")
+
+
+def parse_size(value):
+    """Parse a WIDTHxHEIGHT command line value"""
     try:
-        os.chmod(output_path, stat.S_IRUSR | stat.S_IWUSR | stat.S_IRGRP | stat.S_IROTH)
-        print(f"Set file permissions for: {output_path}")
-    except Exception as e:
-        print(f"Could not set file permissions: {e}")
-    
-    print(f"EPUB file successfully created: {output_path}")
-    return output_path
+        width, height = (int(part) for part in value.lower().split('x'))
+        if width > 0 and height > 0:
+            return width, height
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {value!r}")
 
 
-def main():
+def parse_bytes(value):
+    """Parse a size like 20M, 512K or 1048576 from the command line"""
+    units = {'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+    text = value.strip().upper().rstrip('B')
     try:
-        print("Starting RSS to EPUB conversion...")
+        if text and text[-1] in units:
+            size = float(text[:-1]) * units[text[-1]]
+        else:
+            size = float(text)
+        if size >= 0:
+            return int(size)
+    except ValueError:
+        pass
+    raise argparse.ArgumentTypeError(f"expected a size like 20M, got {value!r}")
+
+
+def parse_args(argv=None):
+    """Parse command line options"""
+    parser = argparse.ArgumentParser(description="Convert RSS feeds into an EPUB for Kobo e-readers")
+    parser.add_argument('--config', default=CONFIG_PATH, metavar='PATH',
+                        help="feed list to read (default: config next to rss.py)")
+    parser.add_argument('--output-dir', default=OUTPUT_DIR, metavar='DIR',
+                        help=f"directory the EPUB is written to (default {OUTPUT_DIR})")
+    parser.add_argument('--cache-dir', default=CACHE_DIR, metavar='DIR',
+                        help="directory for feed, image and article caches (default: cache next to rss.py)")
+    parser.add_argument('--language', default=LANGUAGE, metavar='TAG',
+                        help=f"language tag of the EPUB (default {LANGUAGE})")
+    parser.add_argument('--render-profiles', default=RENDER_PROFILES_PATH, metavar='PATH',
+                        help="file of output profiles (output directory, image settings, language, ...), "
+                             "each rendered from the same fetch")
+    parser.add_argument('--image-resize', choices=['screen', 'scale'], default=IMAGE_RESIZE_MODE,
+                        help="fit images inside --max-image-size (screen) or shrink them to 30%% (scale)")
+    parser.add_argument('--image-encoding', choices=['color', 'grayscale', 'eink'], default=IMAGE_ENCODING,
+                        help="keep color images, convert them to 8-bit gray, or dither them to 16 grays for e-ink")
+    parser.add_argument('--max-image-size', type=parse_size, default=IMAGE_MAX_SIZE, metavar='WxH',
+                        help=f"image bounds in screen mode (default {IMAGE_MAX_SIZE[0]}x{IMAGE_MAX_SIZE[1]})")
+    parser.add_argument('--full', action='store_true', default=FULL_REBUILD,
+                        help="include articles already delivered by earlier runs")
+    parser.add_argument('--keep-duplicates', action='store_true',
+                        help="keep articles that also appear in an earlier feed")
+    parser.add_argument('--cover-seed', choices=['random', 'date', 'content'], default=COVER_SEED,
+                        help="random cover every run, or one reusable cover per day or per set of articles")
+    parser.add_argument('--split', choices=['none', 'feed', 'size'], default=SPLIT_MODE,
+                        help="write one EPUB (none), one per feed (feed), or volumes limited by "
+                             "--volume-size / --volume-chapters (size)")
+    parser.add_argument('--volume-size', type=parse_bytes, default=VOLUME_MAX_BYTES, metavar='SIZE',
+                        help="size budget per volume when splitting, e.g. 20M, 0 for none (default 20M)")
+    parser.add_argument('--volume-chapters', type=int, default=VOLUME_MAX_CHAPTERS, metavar='N',
+                        help="articles per volume when splitting, 0 for no limit (default)")
+    parser.add_argument('--chapter-size', type=parse_bytes, default=CHAPTER_TARGET_BYTES, metavar='SIZE',
+                        help="merge short articles and split long ones into chapter files of about this size, "
+                             "0 for one file per article (default 64K)")
+    parser.add_argument('--zip-policy', choices=['auto', 'deflate', 'store'], default=ZIP_POLICY,
+                        help="store already compressed images and deflate text (auto), deflate everything, "
+                             "or store everything uncompressed")
+    parser.add_argument('--zip-level', type=int, choices=range(1, 10), default=ZIP_LEVEL, metavar='1-9',
+                        help=f"deflate level for text in the EPUB (default {ZIP_LEVEL})")
+    parser.add_argument('--deadline', type=float, default=RUN_DEADLINE, metavar='SECONDS',
+                        help=f"time budget of the whole run, feeds and images still missing when it runs "
+                             f"out are left out (default {RUN_DEADLINE}, 0 for none)")
+    parser.add_argument('--daemon', action='store_true',
+                        help="keep running and prefetch feeds and images into the warm store while Wi-Fi is up")
+    parser.add_argument('--interval', type=float, default=DAEMON_INTERVAL, metavar='SECONDS',
+                        help=f"time between background refreshes (default {DAEMON_INTERVAL})")
+    parser.add_argument('--no-store', action='store_true',
+                        help="fetch feeds now even if the daemon prefetched them recently")
+    parser.add_argument('--profile', choices=['cpu', 'memory', 'all'],
+                        help="write a cProfile (cpu) and/or tracemalloc (memory) dump next to the EPUB")
+    return parser.parse_args(argv)
+
+
+def apply_args(args):
+    """Apply command line options to the module settings"""
+    global CONFIG_PATH, OUTPUT_DIR, IMAGE_RESIZE_MODE, IMAGE_MAX_SIZE, IMAGE_ENCODING, FULL_REBUILD, COVER_SEED
+    global SPLIT_MODE, VOLUME_MAX_BYTES, VOLUME_MAX_CHAPTERS, RUN_DEADLINE, DAEMON_INTERVAL, USE_WARM_STORE
+    global DEDUPLICATE, ZIP_POLICY, ZIP_LEVEL, CHAPTER_TARGET_BYTES, LANGUAGE, RENDER_PROFILES_PATH
+    CONFIG_PATH = args.config
+    OUTPUT_DIR = args.output_dir
+    LANGUAGE = args.language
+    RENDER_PROFILES_PATH = args.render_profiles
+    if args.cache_dir != CACHE_DIR:
+        set_cache_dir(args.cache_dir)
+    IMAGE_RESIZE_MODE = args.image_resize
+    IMAGE_ENCODING = args.image_encoding
+    IMAGE_MAX_SIZE = args.max_image_size
+    FULL_REBUILD = args.full
+    DEDUPLICATE = not args.keep_duplicates
+    COVER_SEED = args.cover_seed
+    SPLIT_MODE = args.split
+    VOLUME_MAX_BYTES = args.volume_size
+    VOLUME_MAX_CHAPTERS = args.volume_chapters
+    CHAPTER_TARGET_BYTES = args.chapter_size
+    ZIP_POLICY = args.zip_policy
+    ZIP_LEVEL = args.zip_level
+    RUN_DEADLINE = args.deadline
+    DAEMON_INTERVAL = args.interval
+    USE_WARM_STORE = not args.no_store
+
+
+def output_basename():
+    """File name of today's output, without extension"""
+    return f"RSSFeeds_{datetime.datetime.now().strftime('%Y%m%d')}"
+
+
+def start_profiling(mode):
+    """
+    Start optional profilers
+    
+    Args:
+        mode: None, "cpu" (cProfile in every thread), "memory" (tracemalloc) or "all"
         
-        # Read RSS links from config
-        rss_links = read_config()
-        if not rss_links:
-            print("Error: No RSS links found in config file")
-            return
+    Returns:
+        State passed to stop_profiling()
+    """
+    state = {'mode': mode, 'cpu': None, 'threads': []}
+    if mode in ('cpu', 'all'):
+        import cProfile
         
-        # Fetch content for each RSS feed
-        feeds = []
-        for link in rss_links:
+        def profile_thread(frame, event, arg):
+            # Runs at the first event of every new thread, then hands over to cProfile
+            sys.setprofile(None)
+            thread_profile = cProfile.Profile()
             try:
-                feed = fetch_rss_content(link)
-                if feed.entries:
-                    feeds.append(feed)
-                    print(f"Successfully added feed: {feed.feed.get('title', 'Unknown')}")
-                else:
-                    print(f"Skipping empty feed: {link}")
-            except Exception as e:
-                print(f"Error processing feed {link}: {e}")
-        
-        if not feeds:
-            print("Error: Could not retrieve any content from the RSS feeds")
-            print("Troubleshooting tips:")
-            print("1. Check your internet connection")
-            print("2. Verify the RSS URLs in your config file")
-            print("3. Try opening the RSS URLs in a web browser")
-            print("4. Some websites may block automated requests")
-            return
+                thread_profile.enable()
+                state['threads'].append(thread_profile)
+            except ValueError:
+                pass
         
-        # Create combined EPUB
-        epub_file = create_combined_epub(feeds)
-        print(f"EPUB creation complete: {epub_file}")
+        state['cpu'] = cProfile.Profile()
+        threading.setprofile(profile_thread)
+        state['cpu'].enable()
+    if mode in ('memory', 'all'):
+        import tracemalloc
+        tracemalloc.start(10)
+    return state
+
+
+def stop_profiling(state, base_path):
+    """
+    Stop the profilers and write their dumps next to the EPUB
+    
+    Returns:
+        Dict describing the written dumps, for the run summary
+    """
+    written = {}
+    if state['cpu'] is not None:
+        import pstats
+        state['cpu'].disable()
+        threading.setprofile(None)
+        stats = pstats.Stats(state['cpu'])
+        for thread_profile in state['threads']:
+            stats.add(thread_profile)
+        try:
+            stats.dump_stats(base_path + ".prof")
+            with open(base_path + ".prof.txt", 'w') as f:
+                stats.stream = f
+                stats.sort_stats('cumulative').print_stats(60)
+            written['cpu_profile'] = base_path + ".prof"
+            print(f"CPU profile written to: {base_path}.prof")
+        except OSError as e:
+            print(f"Could not write CPU profile: {e}")
+    if state['mode'] in ('memory', 'all'):
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        written['traced_peak_bytes'] = peak
+        try:
+            with open(base_path + ".tracemalloc.txt", 'w') as f:
+                f.write(f"Traced memory: current {current} bytes, peak {peak} bytes\n\n")
+                for statistic in snapshot.statistics('lineno')[:40]:
+                    f.write(f"{statistic}\n")
+            written['memory_profile'] = base_path + ".tracemalloc.txt"
+            print(f"Memory profile written to: {base_path}.tracemalloc.txt")
+        except OSError as e:
+            print(f"Could not write memory profile: {e}")
+    return written
+
+
+def peak_rss_kb():
+    """Peak resident memory of this process in KB, None where unsupported"""
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage // 1024 if sys.platform == 'darwin' else usage
+    except (ImportError, OSError):
+        return None
+
+
+def run():
+    """Fetch the feeds and build today's EPUB, return the list of EPUB paths"""
+    print("Starting RSS to EPUB conversion...")
+    start_deadline()
+    
+    # Read RSS links from config
+    with metrics.stage('read_config'):
+        rss_links = read_config()
+    if not rss_links:
+        print("Error: No RSS links found in config file")
+        return []
+    
+    # Articles prefetched by the daemon, if it refreshed recently
+    store = load_warm_store(rss_links) if USE_WARM_STORE else None
+    prepared = None
+    if store:
+        refreshed = datetime.datetime.fromtimestamp(store['refreshed']).strftime('%Y-%m-%d %H:%M')
+        print(f"Using {len(store['articles'])} articles prefetched at {refreshed}")
+        metrics.count('warm_store_used')
+        feeds = store['feeds']
+        prepared = store['articles']
+    else:
+        # Load the HTML and image modules while waiting for the network
+        preload_modules()
         
+        # Fetch content for all RSS feeds concurrently
+        feeds = []
+        with metrics.stage('fetch_feeds'):
+            fetched = fetch_all_feeds(rss_links)
+        for link, feed, elapsed in fetched:
+            if feed.entries:
+                feeds.append(feed)
+                print(f"Successfully added feed: {feed.title or 'Unknown'}")
+            else:
+                print(f"Skipping empty feed: {link}")
+    
+    if not feeds:
+        print("Error: Could not retrieve any content from the RSS feeds")
+        print("Troubleshooting tips:")
+        print("1. Check your internet connection")
+        print("2. Verify the RSS URLs in your config file")
+        print("3. Try opening the RSS URLs in a web browser")
+        print("4. Some websites may block automated requests")
+        return []
+    
+    # Drop copies of the same article in overlapping feeds before any image work
+    duplicates = []
+    if DEDUPLICATE:
+        with metrics.stage('deduplicate'):
+            duplicates = drop_duplicate_entries(feeds)
+            metrics.count('duplicates_dropped', len(duplicates))
+            feeds = [feed for feed in feeds if feed.entries]
+    
+    # Skip articles delivered by earlier runs before any image work
+    with metrics.stage('seen_filter'):
+        seen_index = open_seen_index()
+        expire_seen_entries(seen_index)
+        if FULL_REBUILD:
+            print("Full rebuild requested, including previously delivered articles")
+        else:
+            skipped = filter_seen_entries(feeds, seen_index)
+            metrics.count('articles_seen_before', skipped)
+            print(f"Skipped {skipped} articles delivered by earlier runs")
+            feeds = [feed for feed in feeds if feed.entries]
+    if not feeds:
+        print("No new articles since the last run, nothing to do (use --full to rebuild)")
+        seen_index.close()
+        return []
+    
+    # Output profiles rendered from this one fetch
+    profiles = None
+    if RENDER_PROFILES_PATH:
+        profiles = read_profiles()
+        if not profiles:
+            print("No usable output profiles, writing one EPUB with the command line settings")
+        metrics.count('profiles', len(profiles))
+    
+    # Create combined EPUB (or several volumes)
+    with metrics.stage('build_epub'):
+        epub_files, delivered = create_combined_epub(feeds, prepared=prepared, profiles=profiles)
+    print(f"EPUB creation complete: {', '.join(epub_files)}")
+    mark_entries_seen(feeds, seen_index, duplicates, delivered)
+    seen_index.close()
+    
+    stats = http_stats()
+    print(f"HTTP: {stats['requests']} requests, {stats['connections_opened']} connections opened, "
+          f"{stats['connections_reused']} reused")
+    return epub_files
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    apply_args(args)
+    if args.daemon:
+        run_daemon()
+        return
+    profiling = start_profiling(args.profile)
+    epub_files = []
+    try:
+        # A running daemon refresh finishes first, then its store is used
+        with cache_lock():
+            epub_files = run()
     except Exception as e:
         print(f"Error occurred: {e}")
         import traceback
         print(traceback.format_exc())
+        metrics.error('run', e)
+    finally:
+        base_path = os.path.join(OUTPUT_DIR, output_basename())
+        save_host_health()
+        profile = stop_profiling(profiling, base_path)
+        metrics.write_summary(
+            base_path + ".summary.json",
+            epub=epub_files[0] if epub_files else None,
+            epub_bytes=sum(os.path.getsize(path) for path in epub_files) if epub_files else None,
+            volumes=epub_files,
+            peak_rss_kb=peak_rss_kb(),
+            deadline_s=RUN_DEADLINE or None,
+            profile=profile,
+        )
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,311 @@
+# -*- coding: utf-8 -*-
+
+"""
+Offline benchmark for rss.py
+
+Starts the local stand-in server from feedserver.py, writes a config
+pointing at its feeds and runs rss.py against it in a child process,
+once with empty caches ("cold") and once more reusing them ("warm").
+Each run records wall time, peak RSS of the child, bytes and requests
+served, the time until the child sent its first request, and the size
+of the EPUB. The time to import rss.py is measured once per benchmark
+with `python -X importtime`. Warm runs are then repeated once per EPUB
+compression policy ("zip-auto", "zip-deflate", "zip-store") to compare
+build time and EPUB size. Results are printed and can be saved as JSON
+to compare versions of rss.py.
+
+Usage:
+    python bench/bench.py [--script .adds/rss/rss.py] [--feeds 8] [--size medium]
+                          [--latency 0.05] [--failure-rate 0.0] [--repeat 1]
+                          [--zip-policies auto,deflate,store]
+                          [--output results.json] [--compare baseline.json]
+                          [-- extra rss.py options]
+
+Example, comparing the working tree against a saved baseline:
+    python bench/bench.py --output baseline.json
+    (change rss.py)
+    python bench/bench.py --compare baseline.json
+"""
+
+import argparse
+import datetime
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from feedserver import FEED_SIZES, prerender, start_server
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_SCRIPT = os.path.join(REPO_DIR, ".adds", "rss", "rss.py")
+
+# Metrics compared between result files, lower is better for all of them
+METRICS = ('wall_s', 'import_ms', 'first_request_s', 'peak_rss_kb', 'bytes_transferred', 'requests',
+           'build_s', 'epub_bytes')
+
+
+def git_describe(path):
+    """Commit of the tree containing the benchmarked script, if it is a git checkout"""
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(path),
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def measure_imports(script, top=8):
+    """
+    Time importing rss.py with `python -X importtime`
+
+    Only modules loaded at import are included, modules rss.py loads
+    later on are listed under imports_s in its run summary.
+
+    Returns:
+        Dict with the total import time in ms and the slowest modules it imports
+    """
+    command = [sys.executable, '-X', 'importtime', '-c',
+               'import sys; sys.path.insert(0, sys.argv[1]); import rss', os.path.dirname(script)]
+    try:
+        output = subprocess.run(command, capture_output=True, text=True, timeout=120).stderr
+    except (OSError, subprocess.SubprocessError) as e:
+        print(f"  import measurement failed: {e}")
+        return {}
+
+    total = None
+    modules = {}
+    block = {}
+    for line in output.splitlines():
+        # "import time: self [us] | cumulative | imported package", nested imports
+        # are indented and listed before the module importing them
+        parts = line.split('|')
+        if not line.startswith('import time:') or len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        depth = len(name) - len(name.lstrip())
+        if depth == 3:
+            block[name.strip()] = int(parts[1])
+        elif depth == 1:
+            if name.strip() == 'rss':
+                total, modules = int(parts[1]), block
+            block = {}
+    if total is None:
+        print("  import measurement failed:")
+        print(output[-2000:])
+        return {}
+
+    slowest = sorted(modules.items(), key=lambda item: item[1], reverse=True)[:top]
+    return {
+        'import_ms': round(total / 1000, 1),
+        'slowest_ms': {name: round(us / 1000, 1) for name, us in slowest},
+    }
+
+
+def write_config(path, server, feeds, size):
+    """Config alternating RSS and Atom feeds of the requested size"""
+    with open(path, 'w') as f:
+        f.write("# Generated by bench.py\n")
+        for i in range(feeds):
+            kind = 'rss' if i % 2 == 0 else 'atom'
+            f.write(f"{server.base_url}/{kind}/{size}/{i}.xml\n")
+
+
+def run_script(script, work_dir, extra_args, log_path):
+    """
+    Run rss.py once in a child process
+
+    Returns:
+        Dict with wall time, peak RSS, exit code and perf_counter() start of the child
+    """
+    command = [
+        sys.executable, script,
+        '--config', os.path.join(work_dir, 'config'),
+        '--output-dir', os.path.join(work_dir, 'output'),
+        '--cache-dir', os.path.join(work_dir, 'cache'),
+        '--full',
+    ] + list(extra_args)
+
+    with open(log_path, 'w') as log:
+        start = time.perf_counter()
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, cwd=work_dir)
+        # wait4() reports the resource usage of exactly this child
+        _, status, usage = os.wait4(process.pid, 0)
+        wall = time.perf_counter() - start
+    process.returncode = os.waitstatus_to_exitcode(status) if hasattr(os, 'waitstatus_to_exitcode') else status
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss_kb = usage.ru_maxrss // 1024 if sys.platform == 'darwin' else usage.ru_maxrss
+    return {'wall_s': round(wall, 3), 'peak_rss_kb': peak_rss_kb, 'exit_code': process.returncode,
+            'started_at': start}
+
+
+def epub_size(work_dir):
+    books = glob.glob(os.path.join(work_dir, 'output', '*.epub'))
+    return sum(os.path.getsize(book) for book in books)
+
+
+def run_summary(work_dir):
+    """Stage times and counters from the summary rss.py writes next to the EPUB"""
+    for path in glob.glob(os.path.join(work_dir, 'output', '*.summary.json')):
+        try:
+            with open(path) as f:
+                summary = json.load(f)
+        except (OSError, ValueError):
+            continue
+        return {key: summary.get(key, {}) for key in ('stages_s', 'imports_s', 'counters')}
+    return {}
+
+
+def run_benchmark(args, imports):
+    server = start_server(latency=args.latency, failure_rate=args.failure_rate)
+    prerender(server.base_url, args.size, range(args.feeds))
+    results = []
+    try:
+        for repeat in range(args.repeat):
+            work_dir = tempfile.mkdtemp(prefix='rss-bench-')
+            try:
+                write_config(os.path.join(work_dir, 'config'), server, args.feeds, args.size)
+                # Warm runs per compression policy only differ in how the EPUB is written
+                scenarios = [('cold', []), ('warm', [])]
+                scenarios += [(f'zip-{policy}', ['--zip-policy', policy]) for policy in args.zip_policies]
+                for scenario, policy_args in scenarios:
+                    # Each run starts with an empty output directory, the cache is kept after "cold".
+                    # Host history is not kept, so failures injected in one scenario do not
+                    # get the server skipped in the next and every scenario builds the same feeds
+                    shutil.rmtree(os.path.join(work_dir, 'output'), ignore_errors=True)
+                    try:
+                        os.remove(os.path.join(work_dir, 'cache', 'hosts.json'))
+                    except OSError:
+                        pass
+                    server.stats.reset()
+                    log_path = os.path.join(work_dir, f'{scenario}.log')
+                    result = run_script(args.script, work_dir, list(args.extra) + policy_args, log_path)
+                    served = server.stats.snapshot()
+                    started_at = result.pop('started_at')
+                    first_request = served['first_request_at']
+                    result.update({
+                        'import_ms': imports.get('import_ms'),
+                        'first_request_s': round(first_request - started_at, 3) if first_request else None,
+                        'scenario': scenario,
+                        'repeat': repeat,
+                        'bytes_transferred': served['bytes_sent'],
+                        'requests': served['requests'],
+                        'status': served['status'],
+                        'epub_bytes': epub_size(work_dir),
+                    })
+                    result.update(run_summary(work_dir))
+                    # Time spent building the EPUB from cleaned articles and cached images
+                    result['build_s'] = result.get('stages_s', {}).get('build_epub')
+                    results.append(result)
+                    print(f"  {scenario:11s} #{repeat}: {result['wall_s']:7.2f}s  "
+                          f"first request {result['first_request_s'] or 0:5.2f}s  "
+                          f"{result['peak_rss_kb'] / 1024:7.1f} MB RSS  "
+                          f"{result['bytes_transferred'] / 1024:9.1f} KB in {result['requests']} requests  "
+                          f"build {result['build_s'] or 0:5.2f}s  "
+                          f"EPUB {result['epub_bytes'] / 1024:8.1f} KB  exit {result['exit_code']}")
+                    if result['exit_code'] != 0 or not result['epub_bytes']:
+                        print("    run failed, see the log below")
+                        with open(log_path) as log:
+                            print(''.join(log.readlines()[-20:]))
+            finally:
+                if args.keep:
+                    print(f"  kept work directory {work_dir}")
+                else:
+                    shutil.rmtree(work_dir, ignore_errors=True)
+    finally:
+        server.shutdown()
+    return results
+
+
+def summarize(results):
+    """Median of every metric per scenario"""
+    summary = {}
+    for scenario in sorted({result['scenario'] for result in results}):
+        runs = [result for result in results if result['scenario'] == scenario]
+        summary[scenario] = {}
+        for metric in METRICS:
+            values = sorted(run[metric] for run in runs if run.get(metric) is not None)
+            summary[scenario][metric] = values[len(values) // 2] if values else None
+    return summary
+
+
+def print_comparison(summary, baseline):
+    print(f"Compared to {baseline.get('label') or baseline.get('script')} ({baseline.get('commit')}):")
+    for scenario, metrics in summary.items():
+        old = baseline.get('summary', {}).get(scenario)
+        if not old:
+            continue
+        for metric in METRICS:
+            if not old.get(metric) or metrics.get(metric) is None:
+                continue
+            change = 100.0 * (metrics[metric] - old[metric]) / old[metric]
+            print(f"  {scenario:11s} {metric:18s} {old[metric]:>12} -> {metrics[metric]:>12}  ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rss.py against a local stand-in feed server")
+    parser.add_argument('--script', default=DEFAULT_SCRIPT, help="rss.py to benchmark")
+    parser.add_argument('--label', help="name stored with the results")
+    parser.add_argument('--feeds', type=int, default=8, help="number of feeds in the config")
+    parser.add_argument('--size', choices=sorted(FEED_SIZES), default='medium', help="feed size")
+    parser.add_argument('--latency', type=float, default=0.05, help="mean server delay per request in seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    parser.add_argument('--repeat', type=int, default=1, help="cold/warm pairs to run, medians are reported")
+    parser.add_argument('--zip-policies', type=lambda value: [policy for policy in value.split(',') if policy],
+                        default=['auto', 'deflate', 'store'], metavar='LIST',
+                        help="EPUB compression policies to time on warm runs, comma separated, empty for none")
+    parser.add_argument('--output', help="write results as JSON to this file")
+    parser.add_argument('--compare', help="JSON results of an earlier run to compare against")
+    parser.add_argument('--keep', action='store_true', help="keep work directories with logs and EPUBs")
+    parser.add_argument('extra', nargs=argparse.REMAINDER, help="options passed on to rss.py after --")
+    args = parser.parse_args()
+    args.script = os.path.abspath(args.script)
+    if args.extra and args.extra[0] == '--':
+        args.extra = args.extra[1:]
+
+    print(f"Benchmarking {args.script}: {args.feeds} {args.size} feeds, "
+          f"latency {args.latency}s, failure rate {args.failure_rate}")
+    imports = measure_imports(args.script)
+    if imports:
+        slowest = ', '.join(f"{name} {ms:.0f}" for name, ms in imports['slowest_ms'].items())
+        print(f"  import rss: {imports['import_ms']:.1f} ms (slowest, in ms: {slowest})")
+    results = run_benchmark(args, imports)
+    summary = summarize(results)
+
+    report = {
+        'label': args.label,
+        'script': args.script,
+        'commit': git_describe(args.script),
+        'date': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parameters': {
+            'feeds': args.feeds,
+            'size': args.size,
+            'latency': args.latency,
+            'failure_rate': args.failure_rate,
+            'repeat': args.repeat,
+            'zip_policies': args.zip_policies,
+            'extra': args.extra,
+        },
+        'summary': summary,
+        'imports': imports,
+        'runs': results,
+    }
+
+    if args.compare:
+        with open(args.compare) as f:
+            print_comparison(summary, json.load(f))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+"""
+Local stand-in server for rss.py benchmarks
+
+Serves synthetic RSS 2.0 / Atom feeds, article pages and images so that
+rss.py can be measured without touching the network. All content is
+generated from fixed seeds, so every run sees the same bytes and the
+same ETags (conditional GETs answer 304 like real feed hosts).
+
+URL layout:
+    /rss/<size>/<n>.xml      RSS 2.0 feed number n
+    /atom/<size>/<n>.xml     Atom feed number n
+    /article/<n>/<i>.html    Full article page for entry i of feed n
+    /img/<seed>.<ext>        Image, ext is jpg, png or gif; ?w=&h= set the size
+
+Feed sizes are "small", "medium" and "large" (see FEED_SIZES). Latency
+and failures are configured on the server and apply to every request.
+
+Usage:
+    python feedserver.py [--port 8765] [--latency 0.05] [--failure-rate 0.1]
+"""
+
+import argparse
+import hashlib
+import http.server
+import io
+import random
+import re
+import socketserver
+import threading
+import time
+from email.utils import formatdate
+from html import escape
+from urllib.parse import urlparse, parse_qs
+
+from PIL import Image
+
+
+# entries per feed, paragraphs per entry, images per entry
+FEED_SIZES = {
+    'small': {'entries': 5, 'paragraphs': 3, 'images': 1},
+    'medium': {'entries': 20, 'paragraphs': 10, 'images': 3},
+    'large': {'entries': 60, 'paragraphs': 40, 'images': 6},
+}
+
+# Images are drawn from a shared pool so feeds repeat some of them
+IMAGE_POOL = 40
+
+WORDS = ("lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+         "incididunt ut labore et dolore magna aliqua kobo reader feed article").split()
+
+
+class FeedServerStats:
+    """Thread-safe counters of what the server sent"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes_sent = 0
+            self.status = {}
+            self.first_request_at = None
+
+    def record(self, status, size):
+        with self.lock:
+            if self.first_request_at is None:
+                # perf_counter() values are comparable within this process
+                self.first_request_at = time.perf_counter()
+            self.requests += 1
+            self.bytes_sent += size
+            self.status[status] = self.status.get(status, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'requests': self.requests,
+                'bytes_sent': self.bytes_sent,
+                'first_request_at': self.first_request_at,
+                'status': {str(code): count for code, count in sorted(self.status.items())},
+            }
+
+
+def _paragraphs(rng, count):
+    return ''.join(
+        '<p>' + ' '.join(rng.choice(WORDS) for _ in range(rng.randint(40, 120))) + '.</p>'
+        for _ in range(count)
+    )
+
+
+def _image_refs(rng, base_url, count):
+    refs = []
+    for i in range(count):
+        kind = rng.random()
+        seed = rng.randrange(IMAGE_POOL)
+        if kind < 0.6:
+            refs.append(f'<img src="{base_url}/img/{seed}.jpg?w=2400&amp;h=1600" alt="photo {seed}"/>')
+        elif kind < 0.85:
+            # Relative URL, resolved against the article link
+            refs.append(f'<img src="/img/{seed}.png?w=480&amp;h=320" alt="chart {seed}"/>')
+        elif kind < 0.95:
+            refs.append(f'<img src="{base_url}/img/{seed}.png?w=96&amp;h=96" alt="icon"/>')
+        else:
+            # Tracking pixel
+            refs.append(f'<img src="{base_url}/img/{seed}.gif?w=1&amp;h=1"/>')
+    return refs
+
+
+def _entries(base_url, size, number):
+    spec = FEED_SIZES[size]
+    rng = random.Random(f"{size}-{number}")
+    entries = []
+    for i in range(spec['entries']):
+        body = _paragraphs(rng, spec['paragraphs'])
+        images = _image_refs(rng, base_url, spec['images'])
+        # Spread images between the paragraphs
+        parts = body.split('</p>')
+        for j, image in enumerate(images):
+            parts.insert(min(len(parts) - 1, (j + 1) * len(parts) // (len(images) + 1)), image)
+        entries.append({
+            'title': f"Feed {number} article {i}: " + ' '.join(rng.choice(WORDS) for _ in range(6)),
+            'link': f"{base_url}/article/{number}/{i}.html",
+            'published': 1700000000 - i * 3600 - number * 60,
+            'body': '</p>'.join(parts),
+        })
+    return entries
+
+
+def render_rss(base_url, size, number):
+    items = ''.join(f'''
+    <item>
+      <title>{escape(entry['title'])}</title>
+      <link>{entry['link']}</link>
+      <guid>{entry['link']}</guid>
+      <pubDate>{formatdate(entry['published'], usegmt=True)}</pubDate>
+      <description>{escape(entry['body'])}</description>
+    </item>''' for entry in _entries(base_url, size, number))
+    return f'''<?xml version="1.0" encoding="utf-8"?>
+<rss version="2.0">
+  <channel>
+    <title>Benchmark RSS {size} {number}</title>
+    <link>{base_url}/</link>
+    <description>Synthetic feed</description>{items}
+  </channel>
+</rss>
+'''.encode('utf-8')
+
+
+def render_atom(base_url, size, number):
+    entries = ''.join(f'''
+  <entry>
+    <title>{escape(entry['title'])}</title>
+    <link href="{entry['link']}"/>
+    <id>{entry['link']}</id>
+    <updated>{time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(entry['published']))}</updated>
+    <content type="html">{escape(entry['body'])}</content>
+  </entry>''' for entry in _entries(base_url, size, number))
+    return f'''<?xml version="1.0" encoding="utf-8"?>
+<feed xmlns="http://www.w3.org/2005/Atom">
+  <title>Benchmark Atom {size} {number}</title>
+  <id>{base_url}/atom/{size}/{number}</id>
+  <updated>2023-11-14T22:13:20Z</updated>{entries}
+</feed>
+'''.encode('utf-8')
+
+
+def render_article(number, index):
+    rng = random.Random(f"article-{number}-{index}")
+    return f'''<!DOCTYPE html>
+<html><head><title>Article {number}/{index}</title></head>
+<body>
+<nav><a href="/">Home</a> <a href="/about">About</a></nav>
+<article><h1>Article {number}/{index}</h1>{_paragraphs(rng, 12)}</article>
+<footer>Copyright</footer>
+</body></html>
+'''.encode('utf-8')
+
+
+_image_cache = {}
+_image_cache_lock = threading.Lock()
+
+
+def render_image(seed, extension, width, height):
+    """Noisy gradient image, so encoders see realistic photo-like data"""
+    key = (seed, extension, width, height)
+    with _image_cache_lock:
+        if key in _image_cache:
+            return _image_cache[key]
+
+    rng = random.Random(seed)
+    base = Image.linear_gradient('L').resize((width, height))
+    noise = Image.effect_noise((width, height), 40 + seed % 30)
+    image = Image.merge('RGB', (
+        base,
+        Image.blend(base, noise, 0.5),
+        noise,
+    )).rotate(rng.randrange(360), fillcolor=(rng.randrange(256), 128, 64))
+
+    buffer = io.BytesIO()
+    if extension == 'jpg':
+        image.save(buffer, format='JPEG', quality=90)
+    elif extension == 'gif':
+        image.convert('P').save(buffer, format='GIF')
+    else:
+        image.save(buffer, format='PNG')
+    data = buffer.getvalue()
+    with _image_cache_lock:
+        _image_cache[key] = data
+    return data
+
+
+def prerender(base_url, size, numbers):
+    """Render every image the given feeds reference, so timing runs do not pay for it"""
+    pattern = re.compile(r'/img/(\d+)\.(\w+)\?w=(\d+)&amp;h=(\d+)')
+    for number in numbers:
+        for entry in _entries(base_url, size, number):
+            for seed, extension, width, height in pattern.findall(entry['body']):
+                render_image(int(seed), extension, int(width), int(height))
+
+
+class FeedRequestHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', content_type='text/plain', etag=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        if etag:
+            self.send_header('ETag', etag)
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+        self.server.stats.record(status, len(body))
+
+    def do_GET(self):
+        server = self.server
+        if server.latency:
+            time.sleep(server.latency * (0.5 + server.rng.random()))
+        if server.failure_rate and server.rng.random() < server.failure_rate:
+            self._send(503, b'unavailable')
+            return
+
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        parts = url.path.strip('/').split('/')
+        base_url = f"http://{self.headers.get('Host', 'localhost')}"
+        try:
+            if parts[0] in ('rss', 'atom') and len(parts) == 3 and parts[1] in FEED_SIZES:
+                render = render_rss if parts[0] == 'rss' else render_atom
+                body = render(base_url, parts[1], int(parts[2].split('.')[0]))
+                content_type = 'application/rss+xml' if parts[0] == 'rss' else 'application/atom+xml'
+            elif parts[0] == 'article' and len(parts) == 3:
+                body = render_article(int(parts[1]), int(parts[2].split('.')[0]))
+                content_type = 'text/html; charset=utf-8'
+            elif parts[0] == 'img' and len(parts) == 2:
+                seed, extension = parts[1].split('.')
+                width = int(query.get('w', ['800'])[0])
+                height = int(query.get('h', ['600'])[0])
+                body = render_image(int(seed), extension, width, height)
+                content_type = {'jpg': 'image/jpeg', 'png': 'image/png', 'gif': 'image/gif'}[extension]
+            else:
+                self._send(404, b'not found')
+                return
+        except (ValueError, KeyError):
+            self._send(400, b'bad request')
+            return
+
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if self.headers.get('If-None-Match') == etag:
+            self._send(304, etag=etag)
+            return
+        self._send(200, body, content_type, etag)
+
+
+class FeedServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, address, latency=0.0, failure_rate=0.0, seed=0):
+        super().__init__(address, FeedRequestHandler)
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.rng = random.Random(seed)
+        self.stats = FeedServerStats()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(port=0, latency=0.0, failure_rate=0.0, seed=0):
+    """Start a FeedServer on a background thread and return it"""
+    server = FeedServer(('127.0.0.1', port), latency, failure_rate, seed)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve synthetic feeds and images for rss.py benchmarks")
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--latency', type=float, default=0.0, help="mean delay per request in seconds")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="fraction of requests answered with 503")
+    args = parser.parse_args()
+
+    server = FeedServer(('127.0.0.1', args.port), args.latency, args.failure_rate)
+    print(f"Serving benchmark feeds at {server.base_url}/rss/medium/0.xml")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()